@@ -1,6 +1,45 @@
-from fastapi import Request
-from services.query_engine import QueryEngine
+import os
+import asyncio
 
-def get_query_engine(request: Request) -> QueryEngine:
-    """Dependency to get the query engine instance from the application state."""
-    return request.app.state.query_engine
+from fastapi import Request, HTTPException
+from services.engine_registry import EngineRegistry
+from services.state_backend import StateBackend
+from services.ingestion_scheduler import IngestionScheduler
+from services.cache_prewarmer import CachePrewarmer
+
+# How long a request may wait for the background warm-up before getting a 503.
+# Set to 0 to reject immediately while the service is warming up.
+WARMUP_WAIT_TIMEOUT = float(os.getenv("WARMUP_WAIT_TIMEOUT", 10))
+
+def get_engine_registry(request: Request) -> EngineRegistry:
+    """Dependency to get the registry of query engines from the application state."""
+    return request.app.state.engine_registry
+
+async def get_ready_engine_registry(request: Request) -> EngineRegistry:
+    """
+    Dependency to get the engine registry once warm-up has finished. Waits up to
+    WARMUP_WAIT_TIMEOUT seconds, then responds with 503.
+    """
+    ready = request.app.state.warmup.ready
+    if not ready.is_set():
+        try:
+            await asyncio.wait_for(ready.wait(), timeout=WARMUP_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=503,
+                detail="Service is warming up. Please retry shortly.",
+                headers={"Retry-After": "5"}
+            )
+    return request.app.state.engine_registry
+
+def get_state_backend(request: Request) -> StateBackend:
+    """Dependency to get the state backend shared by all workers."""
+    return request.app.state.state_backend
+
+def get_ingestion_scheduler(request: Request) -> IngestionScheduler:
+    """Dependency to get the ingestion job scheduler."""
+    return request.app.state.ingestion_scheduler
+
+def get_cache_prewarmer(request: Request) -> CachePrewarmer:
+    """Dependency to get the query cache prewarmer."""
+    return request.app.state.cache_prewarmer
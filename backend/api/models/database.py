@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 
 class DatabaseConnection(BaseModel):
-    """Pydantic model for the database connection string."""
+    """Pydantic model for the database connection string and the name it is registered under."""
     connection_string: str
+    name: str = "default"
@@ -1,5 +1,11 @@
+from typing import List, Optional
 from pydantic import BaseModel
 
 class NaturalLanguageQuery(BaseModel):
-    """Pydantic model for a user's natural language query."""
+    """
+    Pydantic model for a user's natural language query. `database` names the target
+    database (the default one if omitted); `databases` fans the query out to several.
+    """
     query: str
+    database: Optional[str] = None
+    databases: Optional[List[str]] = None
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+router = APIRouter()
+
+@router.get("/live")
+async def liveness():
+    """
+    Liveness probe. Succeeds as soon as the process is serving requests,
+    even while the model and schema are still warming up.
+    """
+    return {"status": "alive"}
+
+@router.get("/ready")
+async def readiness(request: Request):
+    """
+    Readiness probe. Returns 503 until the background warm-up has finished, and
+    while it failed or left the default database unavailable ("degraded"), along
+    with the timings of the startup phases completed so far.
+    """
+    warmup = request.app.state.warmup
+    body = warmup.as_dict()
+    if warmup.status != "ready":
+        return JSONResponse(status_code=503, content=body)
+    return body
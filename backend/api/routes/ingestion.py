@@ -1,22 +1,36 @@
 import os
-import shutil
 import asyncio
+import hashlib
 from uuid import uuid4
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+
+import aiofiles
 
 from fastapi import (
     APIRouter,
-    UploadFile,
-    File,
+    Request,
     HTTPException,
-    BackgroundTasks,
     Depends,
-    Request
+    Query
 )
 
-from services.query_engine import QueryEngine
-from services.document_processor import DocumentProcessor
-from api.dependencies import get_query_engine
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+    from python_multipart.exceptions import MultipartParseError
+except ImportError: # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+    from multipart.exceptions import MultipartParseError
+
+from services.engine_registry import EngineRegistry, DatabaseConnectionError
+from services.state_backend import StateBackend
+from services.ingestion_scheduler import (
+    IngestionScheduler,
+    QueueFullError,
+    JobStateError,
+    DEFAULT_PRIORITY,
+    remove_file
+)
+from api.dependencies import get_engine_registry, get_state_backend, get_ingestion_scheduler
 from api.models.database import DatabaseConnection
 
 router = APIRouter()
@@ -25,100 +39,258 @@ router = APIRouter()
 UPLOAD_DIR = "uploaded_documents_temp"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Uploads are parsed straight from the request stream and written to disk in chunks of at most
+# UPLOAD_CHUNK_SIZE bytes. Requests declaring a larger Content-Length than MAX_UPLOAD_REQUEST_SIZE
+# are rejected before reading the body, and both limits are enforced while reading, so an
+# oversized upload is cut off as soon as it crosses a limit rather than after it was received.
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+MAX_UPLOAD_FILE_SIZE = int(os.getenv("MAX_UPLOAD_FILE_SIZE", 50 * 1024 * 1024))
+MAX_UPLOAD_REQUEST_SIZE = int(os.getenv("MAX_UPLOAD_REQUEST_SIZE", 200 * 1024 * 1024))
 
-def get_ingestion_status_store(request: Request) -> Dict:
-    """Dependency to get the shared ingestion status store."""
-    return request.app.state.ingestion_status
+# Form field carrying the uploaded documents
+UPLOAD_FIELD = "files"
 
 
-async def process_documents_background(
-    document_processor: DocumentProcessor,
-    file_paths: List[str],
-    job_id: str,
-    status_store: Dict
-):
-    """Asynchronous background task to process documents."""
+def _too_large(which: str, limit: int, name: str = None) -> HTTPException:
+    subject = f"Upload of {name}" if name else "Upload"
+    return HTTPException(status_code=413, detail=f"{subject} exceeds the maximum {which} size of {limit} bytes.")
+
+
+async def receive_uploads(request: Request) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Parses a multipart/form-data request body as it arrives, streaming each file of the
+    UPLOAD_FIELD field to a uniquely named file in UPLOAD_DIR and computing its SHA-256
+    on the fly. Yields the saved file's info as soon as its part ends, while the rest
+    of the request is still being received.
+
+    Raises HTTPException(413) if a size limit is exceeded, and HTTPException(400) if
+    the body is not valid multipart data. The partially written file is removed.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload.")
+    declared_size = request.headers.get("content-length")
+    if declared_size and declared_size.isdigit() and int(declared_size) > MAX_UPLOAD_REQUEST_SIZE:
+        raise _too_large("request", MAX_UPLOAD_REQUEST_SIZE)
+
+    # The parser reports parts through synchronous callbacks; they are queued as events
+    # and handled (with async file writes) after each chunk of the body is fed to it.
+    events: List[Tuple[str, Any]] = []
+    header_field, header_value, headers = bytearray(), bytearray(), {}
+
+    def on_header_end():
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        events.append(("headers", dict(headers)))
+        headers.clear()
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": lambda data, start, end: header_field.extend(data[start:end]),
+        "on_header_value": lambda data, start, end: header_value.extend(data[start:end]),
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", None)),
+    })
+
+    received = 0
+    current = None
     try:
-        await document_processor.process_documents(file_paths, job_id, status_store)
-    except Exception as e:
-        status_store[job_id]["status"] = "Failed"
-        status_store[job_id]["message"] = str(e)
+        async for body_chunk in request.stream():
+            received += len(body_chunk)
+            if received > MAX_UPLOAD_REQUEST_SIZE:
+                raise _too_large("request", MAX_UPLOAD_REQUEST_SIZE)
+            for start in range(0, len(body_chunk), UPLOAD_CHUNK_SIZE):
+                parser.write(body_chunk[start:start + UPLOAD_CHUNK_SIZE])
+                for kind, payload in events:
+                    if kind == "headers":
+                        _, options = parse_options_header(payload.get(b"content-disposition", b""))
+                        filename = options.get(b"filename")
+                        if options.get(b"name") != UPLOAD_FIELD.encode() or filename is None:
+                            continue # Other form fields are ignored
+                        original_name = os.path.basename(filename.decode("utf-8", errors="replace")) or "upload"
+                        path = os.path.join(UPLOAD_DIR, f"{uuid4().hex}_{original_name}")
+                        current = {
+                            "path": path, "filename": original_name, "size": 0,
+                            "digest": hashlib.sha256(), "buffer": await aiofiles.open(path, "wb"),
+                        }
+                    elif current is None:
+                        continue
+                    elif kind == "data":
+                        current["size"] += len(payload)
+                        if current["size"] > MAX_UPLOAD_FILE_SIZE:
+                            raise _too_large("file", MAX_UPLOAD_FILE_SIZE, current["filename"])
+                        current["digest"].update(payload)
+                        await current["buffer"].write(payload)
+                    else:
+                        await current["buffer"].close()
+                        file_info = {key: current[key] for key in ("path", "filename", "size")}
+                        file_info["sha256"] = current["digest"].hexdigest()
+                        current = None
+                        yield file_info
+                events.clear()
+        parser.finalize()
+    except MultipartParseError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed multipart upload: {e}")
     finally:
-        # Clean up temporary files
-        for path in file_paths:
-            try:
-                os.remove(path)
-            except OSError:
-                pass
+        if current is not None:
+            await current["buffer"].close()
+            remove_file(current["path"])
 
 
 @router.post("/connect-database")
-async def connect_database(db_connection: DatabaseConnection, request: Request):
+async def connect_database(db_connection: DatabaseConnection, registry: EngineRegistry = Depends(get_engine_registry)):
     """
-    Connects the application to a new database by creating and initializing a
-    new QueryEngine instance with the provided connection string.
+    Connects a database under the given name (default: "default") and warms its query
+    engine. Other registered databases stay warm; an existing engine with the same
+    name keeps serving until the new one is ready.
     """
     try:
-        # Create a new document processor for the new engine
-        document_processor = DocumentProcessor()
-        # Create and initialize the new query engine
-        new_query_engine = QueryEngine(db_connection.connection_string, document_processor)
-        await new_query_engine.initialize()
-
-        if "error" in new_query_engine.schema:
-            raise HTTPException(status_code=400, detail=f"Failed to analyze database: {new_query_engine.schema['error']}")
-
-        # Replace the old engine in the app state with the new one
-        request.app.state.query_engine = new_query_engine
-        
-        return {"message": "Database connected and schema discovered successfully."}
+        await registry.connect(db_connection.name, db_connection.connection_string)
+    except DatabaseConnectionError as e:
+        raise HTTPException(status_code=400, detail=f"Failed to analyze database: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to connect to database: {e}")
 
+    return {"message": "Database connected and schema discovered successfully.", "name": db_connection.name}
+
+
+@router.get("/databases")
+async def list_databases(registry: EngineRegistry = Depends(get_engine_registry)):
+    """
+    Lists the registered databases and whether each is currently warm in this worker.
+    """
+    return await registry.describe()
+
+
+def _public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Strips internal bookkeeping fields (prefixed with "_") from a job record."""
+    return {key: value for key, value in job.items() if not key.startswith("_")}
+
+
+def _queue_full(detail: str) -> HTTPException:
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": "10"})
 
-@router.post("/upload-documents")
+
+# The body is parsed by the handler itself, so its schema is declared here for the API docs
+UPLOAD_REQUEST_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": [UPLOAD_FIELD],
+            "properties": {UPLOAD_FIELD: {"type": "array", "items": {"type": "string", "format": "binary"}}},
+        }}},
+    }
+}
+
+
+@router.post("/upload-documents", openapi_extra=UPLOAD_REQUEST_SCHEMA)
 async def upload_documents(
-    background_tasks: BackgroundTasks,
-    files: List[UploadFile] = File(...),
-    query_engine: QueryEngine = Depends(get_query_engine),
-    status_store: Dict = Depends(get_ingestion_status_store)
+    request: Request,
+    priority: int = Query(DEFAULT_PRIORITY, ge=0, le=9, description="Job priority; lower values run first."),
+    registry: EngineRegistry = Depends(get_engine_registry),
+    scheduler: IngestionScheduler = Depends(get_ingestion_scheduler)
 ):
     """
-    Accepts multiple document uploads and processes them in the background.
+    Accepts multiple document uploads (multipart field "files") and queues them for
+    background processing. The job is queued as soon as the first file has been
+    received and later files are added to it as they arrive, so processing can start
+    while the rest of the request is still uploading.
+
+    Documents are shared by all connected databases. Responds with 429 when the
+    ingestion queue is full. If the upload fails part-way the job is marked failed;
+    files it already processed stay indexed.
     """
-    if not query_engine:
-        raise HTTPException(status_code=400, detail="Database not connected. Please connect to a database first.")
-
-    job_id = str(uuid4())
-    file_paths = []
-    for f in files:
-        file_location = os.path.join(UPLOAD_DIR, f.filename)
-        try:
-            with open(file_location, "wb") as buffer:
-                shutil.copyfileobj(f.file, buffer)
-            file_paths.append(file_location)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Could not save file {f.filename}: {e}")
-
-    status_store[job_id] = {"status": "Starting", "progress": 0, "message": "File upload complete, starting processing."}
-    
-    background_tasks.add_task(
-        process_documents_background,
-        query_engine.document_processor,
-        file_paths,
-        job_id,
-        status_store
-    )
-
-    return {"message": "Document ingestion started in the background.", "job_id": job_id}
+    if scheduler.is_full():
+        raise _queue_full("Ingestion queue is full. Please retry later.")
+
+    job_id = None
+    document_processor = registry.document_processor
+    saved_files = []
+    try:
+        async for file_info in receive_uploads(request):
+            saved_files.append(file_info)
+            if job_id is None:
+                new_job_id = str(uuid4())
+                await scheduler.submit(new_job_id, document_processor, [file_info], priority, uploading=True)
+                job_id = new_job_id
+            else:
+                await scheduler.add_file(job_id, file_info)
+        if job_id is None:
+            raise HTTPException(status_code=400, detail=f"No files were uploaded in the '{UPLOAD_FIELD}' field.")
+        await scheduler.finish_upload(job_id)
+    except asyncio.CancelledError:
+        await _discard_upload(scheduler, job_id, saved_files, "the request was interrupted.")
+        raise
+    except Exception as e:
+        reason = e.detail if isinstance(e, HTTPException) else str(e) or type(e).__name__
+        await _discard_upload(scheduler, job_id, saved_files, reason)
+        if isinstance(e, HTTPException):
+            raise
+        if isinstance(e, QueueFullError):
+            raise _queue_full(str(e))
+        if isinstance(e, JobStateError):
+            raise HTTPException(status_code=409, detail=f"Job {job_id} was cancelled during the upload.")
+        raise HTTPException(status_code=500, detail=f"Could not save uploaded files: {e}")
+
+    return {"message": "Document ingestion queued.", "job_id": job_id}
+
+
+async def _discard_upload(scheduler: IngestionScheduler, job_id: Optional[str], saved_files: List[Dict[str, Any]], reason: str):
+    """Stops the job of a failed upload (if it was queued) and removes the received files."""
+    if job_id is not None:
+        await scheduler.abort_upload(job_id, reason)
+    for file_info in saved_files:
+        remove_file(file_info["path"])
 
 
 @router.get("/ingestion-status/{job_id}")
-async def get_ingestion_status(job_id: str, status_store: Dict = Depends(get_ingestion_status_store)):
+async def get_ingestion_status(job_id: str, state: StateBackend = Depends(get_state_backend)):
     """
     Returns the progress of a document processing job.
     """
-    job = status_store.get(job_id)
+    job = await state.get_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job ID not found.")
-    return job
+    return _public_job(job)
+
+
+@router.post("/ingestion-jobs/{job_id}/cancel")
+async def cancel_ingestion_job(job_id: str, scheduler: IngestionScheduler = Depends(get_ingestion_scheduler)):
+    """
+    Cancels a queued or running ingestion job. Documents already processed stay
+    indexed, and the job can be resumed later.
+    """
+    try:
+        job = await scheduler.cancel(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job ID not found.")
+    except JobStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _public_job(job)
+
+
+@router.post("/ingestion-jobs/{job_id}/resume")
+async def resume_ingestion_job(
+    job_id: str,
+    priority: Optional[int] = Query(None, ge=0, le=9, description="New priority; defaults to the job's original priority."),
+    registry: EngineRegistry = Depends(get_engine_registry),
+    scheduler: IngestionScheduler = Depends(get_ingestion_scheduler)
+):
+    """
+    Re-queues a cancelled or failed ingestion job, skipping files that were already processed.
+    """
+    try:
+        job = await scheduler.resume(job_id, registry.document_processor, priority)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job ID not found.")
+    except JobStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except QueueFullError as e:
+        raise _queue_full(str(e))
+    return _public_job(job)
@@ -1,6 +1,9 @@
 from fastapi import APIRouter, Request, Depends
 from typing import Dict
 
+from services.cache_prewarmer import CachePrewarmer
+from api.dependencies import get_cache_prewarmer
+
 router = APIRouter()
 
 @router.get("/")
@@ -15,3 +18,11 @@ async def get_metrics(request: Request) -> Dict:
         "avg_response_time": request.app.state.metrics.get("avg_response_time", 0.0),
     }
     return metrics
+
+@router.get("/prewarm")
+async def get_prewarm_status(prewarmer: CachePrewarmer = Depends(get_cache_prewarmer)) -> Dict:
+    """
+    Returns the progress of the latest cache prewarm run per database, and this
+    worker's cache hit rate including hits served from prewarmed entries.
+    """
+    return prewarmer.status()
@@ -1,44 +1,56 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from typing import List, Dict
+from contextlib import AsyncExitStack
+from fastapi import APIRouter, Depends, HTTPException
+from typing import List
 
-from services.query_engine import QueryEngine
-from api.dependencies import get_query_engine
+from services.engine_registry import EngineRegistry, DatabaseConnectionError, UnknownDatabaseError, DEFAULT_DATABASE
+from services.state_backend import StateBackend
+from api.dependencies import get_ready_engine_registry, get_state_backend
 from api.models.query import NaturalLanguageQuery
 
 router = APIRouter()
 
-def get_query_history_store(request: Request) -> List:
-    """Dependency to get the shared query history store."""
-    return request.app.state.query_history
-
 @router.post("/")
 async def process_natural_language_query(
     nl_query: NaturalLanguageQuery,
-    query_engine: QueryEngine = Depends(get_query_engine),
-    query_history: List = Depends(get_query_history_store)
+    registry: EngineRegistry = Depends(get_ready_engine_registry),
+    state: StateBackend = Depends(get_state_backend)
 ):
     """
-    Processes a natural language query against the currently connected data sources.
+    Processes a natural language query against the named database, or concurrently
+    against several databases when `databases` is given.
     """
-    if not query_engine or "error" in query_engine.schema:
-        raise HTTPException(
-            status_code=400,
-            detail="System not ready. Please connect to a database via the ingestion endpoint first."
-        )
-
-    result = await query_engine.process_query(nl_query.query)
+    if nl_query.databases:
+        result = await registry.fan_out(nl_query.query, nl_query.databases)
+    else:
+        async with AsyncExitStack() as stack:
+            # Only looking up (or warming) the engine is mapped to a client error
+            try:
+                query_engine = await stack.enter_async_context(registry.use(nl_query.database))
+            except UnknownDatabaseError as e:
+                if nl_query.database is not None:
+                    raise HTTPException(status_code=404, detail=str(e))
+                raise HTTPException(
+                    status_code=400,
+                    detail="System not ready. Please connect to a database via the ingestion endpoint first."
+                )
+            except DatabaseConnectionError:
+                raise HTTPException(
+                    status_code=400,
+                    detail="System not ready. Please connect to a database via the ingestion endpoint first."
+                )
+            result = await query_engine.process_query(nl_query.query)
     
     if "error" not in result:
-        # Store the query if it was successful
-        if len(query_history) > 100: # Keep history to a reasonable size
-            query_history.pop(0)
-        query_history.append(nl_query.query)
+        # Store the query if it was successful; the backend keeps history to a reasonable size
+        # and counts runs per database, which drives cache prewarming
+        for database in nl_query.databases or [nl_query.database or DEFAULT_DATABASE]:
+            await state.add_query(nl_query.query, database)
 
     return result
 
 @router.get("/history", response_model=List[str])
-async def get_query_history(query_history: List = Depends(get_query_history_store)):
+async def get_query_history(state: StateBackend = Depends(get_state_backend)):
     """
     Returns a list of the most recent successful queries.
     """
-    return query_history
+    return await state.get_query_history()
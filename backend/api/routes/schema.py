@@ -1,16 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-from services.query_engine import QueryEngine
-from api.dependencies import get_query_engine
+from services.engine_registry import EngineRegistry, DatabaseConnectionError, UnknownDatabaseError
+from api.dependencies import get_ready_engine_registry
 
 router = APIRouter()
 
 @router.get("/", response_model=Dict[str, Any])
-async def get_current_schema(query_engine: QueryEngine = Depends(get_query_engine)):
+async def get_current_schema(database: Optional[str] = None, registry: EngineRegistry = Depends(get_ready_engine_registry)):
     """
-    Returns the currently loaded database schema that was discovered on startup.
+    Returns the discovered schema of the named database (the default database if omitted).
     """
+    try:
+        query_engine = await registry.get(database)
+    except (UnknownDatabaseError, DatabaseConnectionError):
+        query_engine = None
     if not query_engine or "error" in query_engine.schema:
         raise HTTPException(
             status_code=404,
@@ -0,0 +1,101 @@
+"""
+Benchmark for quantized embedding storage.
+
+Builds a corpus of embeddings, then compares float16 and int8 storage against exact
+float32 search: recall@k, search latency and in-memory size. The "rescore" column is
+the candidate multiplier for exact re-scoring; at 1x the result set is exactly the
+approximate top-k, so its recall is that of the quantized pass alone.
+
+Usage (from the backend directory):
+    python -m benchmarks.embedding_quantization [--docs ../sample_data/sample_docs]
+
+Without --docs a synthetic clustered corpus shaped like MiniLM embeddings (384 dims)
+is used, so the benchmark also runs without the embedding model.
+"""
+import os
+import time
+import argparse
+
+import numpy as np
+
+from services.embedding_index import EmbeddingIndex
+
+
+def synthetic_corpus(size: int, dim: int, queries: int, seed: int = 0):
+    """Clustered vectors sharing a common direction, like sentence embeddings."""
+    rng = np.random.default_rng(seed)
+    common = rng.normal(size=dim)
+    centers = rng.normal(size=(max(size // 100, 1), dim)) + 2 * common
+    corpus = centers[rng.integers(len(centers), size=size)] + 0.6 * rng.normal(size=(size, dim))
+    picks = rng.integers(size, size=queries)
+    query_vectors = corpus[picks] + 0.6 * rng.normal(size=(queries, dim))
+    return corpus.astype(np.float32), query_vectors.astype(np.float32)
+
+
+def document_corpus(docs_dir: str, queries: int, seed: int = 0):
+    """Embeds the chunks of every .txt document in `docs_dir`; queries are chunk sentences."""
+    from services.document_processor import DocumentProcessor
+    from services.embedding_model import get_sentence_transformer_model
+
+    model = get_sentence_transformer_model()
+    processor = DocumentProcessor()
+    chunks = []
+    for name in sorted(os.listdir(docs_dir)):
+        if name.endswith(".txt"):
+            with open(os.path.join(docs_dir, name), encoding="utf-8", errors="ignore") as f:
+                chunks.extend(processor.dynamic_chunking(f.read(), ".txt"))
+    rng = np.random.default_rng(seed)
+    sentences = [s for chunk in chunks for s in chunk.split(". ") if s]
+    picked = [sentences[i] for i in rng.integers(len(sentences), size=queries)]
+    return model.encode(chunks), model.encode(picked)
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    corpus = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = queries @ corpus.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def evaluate(precision: str, rescore_factor: int, corpus, queries, truth, k: int):
+    index = EmbeddingIndex(precision=precision, rescore_factor=rescore_factor)
+    index.add(corpus)
+    hits = 0
+    start = time.perf_counter()
+    for query, expected in zip(queries, truth):
+        found = {row for row, _ in index.search(query, top_k=k)}
+        hits += len(found & set(expected.tolist()))
+    latency_ms = (time.perf_counter() - start) / len(queries) * 1000
+    size = index.nbytes
+    index.close()
+    return hits / truth.size, latency_ms, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", help="Directory of .txt documents to embed instead of a synthetic corpus.")
+    parser.add_argument("--size", type=int, default=50000, help="Synthetic corpus size.")
+    parser.add_argument("--dim", type=int, default=384, help="Synthetic embedding dimension.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.docs:
+        corpus, queries = document_corpus(args.docs, args.queries)
+    else:
+        corpus, queries = synthetic_corpus(args.size, args.dim, args.queries)
+    k = min(args.k, len(corpus))
+    truth = exact_top_k(corpus, queries, k)
+
+    print(f"corpus: {corpus.shape[0]} x {corpus.shape[1]}, queries: {len(queries)}, recall@{k}")
+    print(f"{'precision':<10}{'rescore':>9}{'recall':>9}{'ms/query':>10}{'memory':>12}{'saving':>9}")
+    baseline = None
+    for precision, factor in [("float32", 1), ("float16", 1), ("float16", 4), ("int8", 1), ("int8", 4)]:
+        recall, latency, size = evaluate(precision, factor, corpus, queries, truth, k)
+        baseline = baseline or size
+        rescore = "-" if precision == "float32" else f"{factor}x"
+        print(f"{precision:<10}{rescore:>9}{recall:>9.4f}{latency:>10.2f}{size / 2**20:>10.1f}MB{baseline / size:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
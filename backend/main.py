@@ -1,10 +1,17 @@
+import time
+import asyncio
 import logging
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
-from api.routes import ingestion, query, schema, metrics
-from services.query_engine import QueryEngine
+from api.routes import ingestion, query, schema, metrics, health
 from services.document_processor import DocumentProcessor
+from services.engine_registry import EngineRegistry, DatabaseConnectionError, DEFAULT_DATABASE
+from services.embedding_model import get_sentence_transformer_model
+from services.state_backend import create_state_backend
+from services.ingestion_scheduler import IngestionScheduler
+from services.cache_prewarmer import CachePrewarmer
+from services.warmup import WarmupTracker
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,16 +31,41 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+async def warm_up(registry: EngineRegistry, connection_string: str, warmup: WarmupTracker):
+    """
+    Background warm-up: loads the embedding model, syncs ingested documents and
+    analyzes the default database schema. Requests needing these wait on `warmup.ready`.
+    """
+    try:
+        await warmup.run_phase("embedding_model", asyncio.to_thread(get_sentence_transformer_model))
+        await warmup.run_phase("document_sync", registry.document_processor.sync_chunks())
+        # Warm the default engine (connects to DB, discovers schema), keeping the shared result cache
+        try:
+            await warmup.run_phase("schema_analysis", registry.connect(DEFAULT_DATABASE, connection_string, refresh=False))
+        except DatabaseConnectionError as e:
+            warmup.mark_degraded(e)
+            return
+        warmup.mark_ready()
+    except Exception as e:
+        warmup.mark_failed(e)
+
 @app.on_event("startup")
 async def startup_event():
     """
-    Application startup event. Initializes the query engine and shared state.
+    Application startup event. Creates the query engine and shared state, then
+    returns immediately; model loading and schema analysis run in the background.
     """
+    startup_start = time.perf_counter()
     logging.info("Starting application initialization...")
     
-    # Initialize shared state objects
-    app.state.ingestion_status = {}
-    app.state.query_history = []
+    # Ingestion jobs, query history, the result cache and document chunks live in the
+    # state backend so that several workers (uvicorn --workers N) share them.
+    state_backend = create_state_backend()
+    await state_backend.start()
+    app.state.state_backend = state_backend
+    # Document ingestion runs on a bounded queue and worker pool, apart from query serving
+    app.state.ingestion_scheduler = IngestionScheduler(state_backend)
+    await app.state.ingestion_scheduler.start()
     app.state.metrics = {
         "queries_processed": 0,
         "documents_indexed": 0,
@@ -45,21 +77,46 @@ async def startup_event():
     default_connection_string = "sqlite+aiosqlite:///./default_database.db"
     logging.info(f"Using default database: {default_connection_string}")
 
-    document_processor = DocumentProcessor()
-    query_engine = QueryEngine(default_connection_string, document_processor)
-    
-    # Initialize the engine (connects to DB, discovers schema)
-    await query_engine.initialize()
+    # One document processor is shared by the query engines of all named databases
+    document_processor = DocumentProcessor(state_backend)
+    registry = EngineRegistry(document_processor, state_backend)
+
+    # The most frequent queries are re-run in the background whenever the cache goes cold:
+    # when an engine is warmed (startup, reconnect, on-demand) and after each ingestion
+    prewarmer = CachePrewarmer(registry, state_backend)
+    warmup = WarmupTracker()
+
+    def on_warm(name: str):
+        prewarmer.schedule(name, reason="schema_reload")
+        # A worker whose default database failed to warm becomes ready once it is connected
+        if name == DEFAULT_DATABASE and warmup.status == "degraded":
+            warmup.mark_ready()
+
+    registry.on_warm = on_warm
+    app.state.ingestion_scheduler.on_job_completed = lambda job_id: prewarmer.schedule_all(reason="ingestion")
+    app.state.cache_prewarmer = prewarmer
     
-    # Store the initialized engine in the application state
-    app.state.query_engine = query_engine
-    logging.info("Application initialization complete.")
+    # Store the registry in the application state; the default engine is warmed by the warm-up task
+    app.state.engine_registry = registry
+    app.state.warmup = warmup
+    app.state.warmup_task = asyncio.create_task(warm_up(registry, default_connection_string, warmup))
+    logging.info(f"Application initialization complete in {time.perf_counter() - startup_start:.2f}s; warming up in the background.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Application shutdown event. Stops warm-up and ingestion, then releases engines and the state backend."""
+    app.state.warmup_task.cancel()
+    await app.state.cache_prewarmer.stop()
+    await app.state.ingestion_scheduler.stop()
+    await app.state.engine_registry.close()
+    await app.state.state_backend.close()
 
 # Include API routers
 app.include_router(ingestion.router, prefix="/api/ingest", tags=["Data Ingestion"])
 app.include_router(query.router, prefix="/api/query", tags=["Query"])
 app.include_router(schema.router, prefix="/api/schema", tags=["Schema"])
 app.include_router(metrics.router, prefix="/api/metrics", tags=["Metrics"])
+app.include_router(health.router, prefix="/health", tags=["Health"])
 
 @app.get("/", tags=["Root"])
 async def read_root():
@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from services.engine_registry import EngineRegistry, DatabaseConnectionError, UnknownDatabaseError
+from services.state_backend import StateBackend
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Number of most frequent queries re-run per database after a cache reset
+CACHE_PREWARM_TOP_N = int(os.getenv("CACHE_PREWARM_TOP_N", 20))
+# Pause between prewarm queries, so that prewarming stays in the background
+CACHE_PREWARM_PAUSE = float(os.getenv("CACHE_PREWARM_PAUSE", 0.05))
+# Longest a prewarm query waits for user queries to finish before running anyway
+CACHE_PREWARM_MAX_WAIT = 1.0
+
+
+class CachePrewarmer:
+    """
+    Repopulates the query cache after it goes cold (startup, a database being warmed
+    or reconnected, a completed ingestion) by re-running the most frequent queries
+    from the query log.
+
+    Prewarming runs one query at a time across all databases and yields to user
+    queries being served by this worker. Prewarmed cache entries are marked so
+    that hits on them can be reported.
+    """
+    def __init__(self, registry: EngineRegistry, state: StateBackend, top_n: int = CACHE_PREWARM_TOP_N, pause: float = CACHE_PREWARM_PAUSE):
+        self.registry = registry
+        self.state = state
+        self.top_n = top_n
+        self.pause = pause
+        self._lock = asyncio.Lock()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # database -> progress of its latest prewarm run
+        self.runs: Dict[str, Dict[str, Any]] = {}
+
+    def schedule(self, database: str, reason: str):
+        """Starts prewarming `database` in the background, restarting any run in progress."""
+        if self.top_n <= 0:
+            return
+        task = self._tasks.get(database)
+        if task is not None and not task.done():
+            task.cancel()
+        self._tasks[database] = asyncio.create_task(self._run(database, reason))
+
+    def schedule_all(self, reason: str):
+        """Prewarms every database that is warm in this worker."""
+        for database in self.registry.warm_databases():
+            self.schedule(database, reason)
+
+    async def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "top_n": self.top_n,
+            "runs": [dict(run) for run in self.runs.values()],
+            "cache": self.registry.cache_stats(),
+        }
+
+    async def _run(self, database: str, reason: str):
+        run = {
+            "database": database,
+            "reason": reason,
+            "status": "Queued",
+            "total": 0,
+            "processed": 0,
+            "warmed": 0,
+            "already_cached": 0,
+            "failed": 0,
+            "started_at": time.time(),
+            "duration": None,
+        }
+        self.runs[database] = run
+        start = time.perf_counter()
+        try:
+            queries = await self.state.get_top_queries(self.top_n, database)
+            run.update(status="Running", total=len(queries))
+            for query, _ in queries:
+                async with self._lock:
+                    await self._wait_for_idle()
+                    warmed = await self._prewarm(database, query)
+                if warmed is None:
+                    run["failed"] += 1
+                elif warmed:
+                    run["warmed"] += 1
+                else:
+                    run["already_cached"] += 1
+                run["processed"] += 1
+                await asyncio.sleep(self.pause)
+            run["status"] = "Completed"
+        except asyncio.CancelledError:
+            run["status"] = "Cancelled"
+            raise
+        except (UnknownDatabaseError, DatabaseConnectionError) as e:
+            run["status"] = "Failed"
+            logging.error(f"Cache prewarm of database '{database}' failed: {e}")
+        finally:
+            run["duration"] = time.perf_counter() - start
+        logging.info(
+            f"Cache prewarm of database '{database}' ({reason}) finished: {run['warmed']} warmed, "
+            f"{run['already_cached']} already cached, {run['failed']} failed in {run['duration']:.2f}s."
+        )
+
+    async def _prewarm(self, database: str, query: str) -> Optional[bool]:
+        """Returns whether `query` was newly cached, or None if it failed."""
+        async with self.registry.use(database) as engine:
+            try:
+                return await engine.prewarm_query(query)
+            except Exception as e:
+                logging.warning(f"Prewarm query failed on database '{database}': {e}")
+                return None
+
+    async def _wait_for_idle(self):
+        """Waits, up to CACHE_PREWARM_MAX_WAIT seconds, until no user query is being served."""
+        deadline = time.monotonic() + CACHE_PREWARM_MAX_WAIT
+        while self.registry.active_queries() > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(self.pause or 0.01)
@@ -1,145 +1,225 @@
 import os
 import logging
 import asyncio
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, AsyncIterator, Awaitable, Callable, Tuple
 import re
+from concurrent.futures import Executor
 
-import aiofiles
-from docx import Document
-import pypdf
+from services.embedding_index import EmbeddingIndex
+from services.embedding_model import get_sentence_transformer_model
+from services.state_backend import StateBackend, InMemoryStateBackend, CHUNKS_TOPIC
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Lazy loading for sentence-transformers model
-_model = None
-
-def get_sentence_transformer_model():
-    global _model
-    if _model is None:
-        try:
-            from sentence_transformers import SentenceTransformer
-            _model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-            logging.info("SentenceTransformer model loaded.")
-        except ImportError:
-            logging.error("sentence-transformers library not found. Please install it.")
-            return None
-    return _model
+# Number of chunks handed to the embedding model per call during ingestion
+ENCODE_BATCH_SIZE = 64
+
+
+# Extraction and encoding are module-level functions so that ingestion can run them in a
+# separate process (see IngestionScheduler), away from the threads serving queries.
+
+def extract_text(file_path: str) -> str:
+    """Extracts text from a .txt, .pdf or .docx file; returns "" if it cannot."""
+    file_type = os.path.splitext(file_path)[1].lower()
+    try:
+        if file_type == ".txt":
+            with open(file_path, "r", encoding='utf-8', errors='ignore') as f:
+                return f.read()
+        elif file_type == ".pdf":
+            return _extract_text_from_pdf(file_path)
+        elif file_type == ".docx":
+            return _extract_text_from_docx(file_path)
+        else:
+            logging.warning(f"Unsupported file type: {file_type} for {file_path}")
+            return ""
+    except Exception as e:
+        logging.error(f"Error extracting text from {file_path}: {e}")
+        return ""
+
+
+def _extract_text_from_pdf(file_path: str) -> str:
+    """Helper function to extract text from a PDF file."""
+    import pypdf
+
+    text = ""
+    with open(file_path, "rb") as f:
+        reader = pypdf.PdfReader(f)
+        for page in reader.pages:
+            text += page.extract_text() + "\n"
+    return text
+
+
+def _extract_text_from_docx(file_path: str) -> str:
+    """Helper function to extract text from a DOCX file."""
+    from docx import Document
+
+    doc = Document(file_path)
+    return "\n".join([para.text for para in doc.paragraphs])
+
+
+def dynamic_chunking(content: str) -> List[str]:
+    """
+    Splits content into meaningful chunks based on content structure.
+    Aims to keep related content together and respects sentence boundaries.
+    """
+    chunks = []
+    # Simple sentence splitting using regex
+    sentences = re.split(r'(?<=[.!?])\s+', content)
+    
+    current_chunk = ""
+    for sentence in sentences:
+        # Estimate token count by character count (simple proxy)
+        if len(current_chunk) + len(sentence) < 500:  # Aim for ~500 characters per chunk
+            current_chunk += (sentence + " ")
+        else:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+            current_chunk = sentence + " "
+    
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+
+    return [chunk for chunk in chunks if chunk]
+
+
+def extract_chunks(file_path: str, file_name: str) -> List[Dict[str, Any]]:
+    """Extracts and chunks a single document."""
+    content = extract_text(file_path)
+    if not content:
+        return []
+    return [{
+        "file_path": file_name,
+        "chunk_id": j,
+        "content": chunk_content
+    } for j, chunk_content in enumerate(dynamic_chunking(content))]
+
+
+def encode_texts(contents: List[str]):
+    """Embeds `contents` with this process's embedding model."""
+    model = get_sentence_transformer_model()
+    if not model:
+        raise RuntimeError("Embedding model not available.")
+    return model.encode(contents, batch_size=32)
+
+async def _iter_files(
+    files: List[Dict[str, Any]],
+    wait_for_files: Optional[Callable[[int], Awaitable[bool]]]
+) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """Yields (index, file) pairs, waiting for more files while `wait_for_files` says so."""
+    i = 0
+    while i < len(files) or (wait_for_files is not None and await wait_for_files(i)):
+        yield i, files[i]
+        i += 1
+
 
 class DocumentProcessor:
     """
     Handles the processing of unstructured documents, including text extraction,
     chunking, and generating embeddings.
     """
-    def __init__(self):
-        # NOTE: In a production environment, this would be a connection to a persistent
-        # vector database like ChromaDB, FAISS, or a managed service.
-        # For this assignment, we use an in-memory store for simplicity.
+    def __init__(self, state_backend: StateBackend = None):
+        # Chunks are persisted through the state backend, which is shared by all workers.
+        # `chunk_store` is this process's in-memory mirror used for search; it is kept
+        # up to date whenever the backend reports new chunks. Embeddings are kept apart
+        # from the chunk metadata in a packed (optionally quantized) index, row-aligned
+        # with `chunk_store`.
+        self.state = state_backend or InMemoryStateBackend()
         self.chunk_store: List[Dict[str, Any]] = []
+        self.embedding_index = EmbeddingIndex()
+        self._last_chunk_id = 0
+        self._sync_lock = asyncio.Lock()
+        self.state.subscribe(CHUNKS_TOPIC, self.sync_chunks)
+
+    async def sync_chunks(self):
+        """Pulls chunks added to the state backend (by any worker) into the local store."""
+        async with self._sync_lock:
+            new_chunks = await self.state.get_chunks(self._last_chunk_id)
+            if not new_chunks:
+                return
+            self.embedding_index.add([chunk["embedding"] for _, chunk in new_chunks])
+            self.chunk_store.extend(
+                {key: value for key, value in chunk.items() if key != "embedding"} for _, chunk in new_chunks
+            )
+            self._last_chunk_id = new_chunks[-1][0]
+            logging.info(f"Synced {len(new_chunks)} chunks from the state backend.")
 
-    async def _extract_text(self, file_path: str, file_type: str) -> str:
-        """Asynchronously extracts text from a file based on its type."""
-        try:
-            if file_type == ".txt":
-                async with aiofiles.open(file_path, "r", encoding='utf-8', errors='ignore') as f:
-                    return await f.read()
-            elif file_type == ".pdf":
-                return await asyncio.to_thread(self._extract_text_from_pdf, file_path)
-            elif file_type == ".docx":
-                return await asyncio.to_thread(self._extract_text_from_docx, file_path)
-            else:
-                logging.warning(f"Unsupported file type: {file_type} for {file_path}")
-                return ""
-        except Exception as e:
-            logging.error(f"Error extracting text from {file_path}: {e}")
-            return ""
-
-    def _extract_text_from_pdf(self, file_path: str) -> str:
-        """Helper function to extract text from a PDF file."""
-        text = ""
-        with open(file_path, "rb") as f:
-            reader = pypdf.PdfReader(f)
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+    def dynamic_chunking(self, content: str, doc_type: str) -> List[str]:
+        """Splits content into chunks of about 500 characters along sentence boundaries."""
+        return dynamic_chunking(content)
 
-    def _extract_text_from_docx(self, file_path: str) -> str:
-        """Helper function to extract text from a DOCX file."""
-        doc = Document(file_path)
-        return "\n".join([para.text for para in doc.paragraphs])
+    async def extract_chunks(self, file_path: str, file_name: str, executor: Optional[Executor] = None) -> List[Dict[str, Any]]:
+        """Extracts and chunks a single document on `executor` (the default thread pool if None)."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, extract_chunks, file_path, file_name)
 
-    def dynamic_chunking(self, content: str, doc_type: str) -> List[str]:
+    async def _encode(self, contents: List[str], executor: Optional[Executor] = None):
         """
-        Splits content into meaningful chunks based on document type and content structure.
-        Aims to keep related content together and respects sentence boundaries.
+        Encodes chunk contents in batches of ENCODE_BATCH_SIZE on `executor` (the default
+        thread pool if None). Yielding between batches lets cancellation take effect and
+        keeps a large document from monopolising the encoder.
         """
-        chunks = []
-        # Simple sentence splitting using regex
-        sentences = re.split(r'(?<=[.!?])\s+', content)
-        
-        current_chunk = ""
-        for sentence in sentences:
-            # Estimate token count by character count (simple proxy)
-            if len(current_chunk) + len(sentence) < 500:  # Aim for ~500 characters per chunk
-                current_chunk += (sentence + " ")
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence + " "
-        
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        loop = asyncio.get_running_loop()
+        embeddings = []
+        for start in range(0, len(contents), ENCODE_BATCH_SIZE):
+            batch = contents[start:start + ENCODE_BATCH_SIZE]
+            embeddings.extend(await loop.run_in_executor(executor, encode_texts, batch))
+        return embeddings
+
+    async def process_documents(
+        self,
+        files: List[Dict[str, Any]],
+        job_id: str,
+        completed: Optional[List[int]] = None,
+        executor: Optional[Executor] = None,
+        wait_for_files: Optional[Callable[[int], Awaitable[bool]]] = None
+    ):
+        """
+        Asynchronously processes a list of uploaded documents, generates embeddings in
+        batches, and adds the chunks to the shared store. Job progress is recorded
+        in the state backend.
 
-        return [chunk for chunk in chunks if chunk]
+        Each entry in `files` holds the on-disk "path" and the original "filename". Text
+        extraction and embedding both run on `executor`, so the caller controls how much
+        CPU ingestion may use.
 
+        Chunks are committed file by file, in the same transaction that records the
+        file's index in the job's "completed_files", so a job cancelled at any point
+        never stores a file's chunks without marking it done. A resumed job passes
+        "completed_files" as `completed` and only processes the remaining files.
 
-    async def process_documents(self, file_paths: List[str], job_id: str, ingestion_status: Dict):
-        """
-        Asynchronously processes a list of documents, generates embeddings in batches,
-        and updates the in-memory vector store.
+        `files` may still grow while the job runs (an upload in progress): after the last
+        file, `wait_for_files(count)` is awaited and returns whether more have arrived.
         """
-        model = get_sentence_transformer_model()
-        if not model:
-            ingestion_status[job_id] = {"status": "Failed", "progress": 100, "message": "Embedding model not available."}
-            return
-
-        total_files = len(file_paths)
-        all_chunks = []
-
-        for i, file_path in enumerate(file_paths):
-            file_name = os.path.basename(file_path)
-            ingestion_status[job_id]["status"] = f"Processing {file_name}..."
-            
-            doc_type = os.path.splitext(file_path)[1].lower()
-            content = await self._extract_text(file_path, doc_type)
-
-            if content:
-                chunks = self.dynamic_chunking(content, doc_type)
-                for j, chunk_content in enumerate(chunks):
-                    all_chunks.append({
-                        "file_path": file_name,
-                        "chunk_id": j,
-                        "content": chunk_content
-                    })
-            ingestion_status[job_id]["progress"] = ((i + 1) / total_files) * 100
-
-        if all_chunks:
-            logging.info(f"Generating embeddings for {len(all_chunks)} chunks...")
-            ingestion_status[job_id]["status"] = f"Generating embeddings for {len(all_chunks)} chunks..."
-            
-            chunk_contents = [chunk["content"] for chunk in all_chunks]
-            # Use asyncio.to_thread for the blocking encode call
-            embeddings = await asyncio.to_thread(model.encode, chunk_contents, batch_size=32)
-            
-            for i, embedding in enumerate(embeddings):
-                all_chunks[i]["embedding"] = embedding
-            
-            # Atomically update the chunk store
-            self.chunk_store.extend(all_chunks)
-            logging.info(f"Added {len(all_chunks)} new chunks to the store.")
-
-        ingestion_status[job_id]["status"] = "Completed"
-        ingestion_status[job_id]["message"] = f"Successfully processed {total_files} documents."
+        completed = set(completed or [])
+
+        async for i, file_info in _iter_files(files, wait_for_files):
+            if i in completed:
+                continue
+            file_name = file_info["filename"]
+            await self.state.update_job(job_id, status=f"Processing {file_name}...")
+
+            chunks = await self.extract_chunks(file_info["path"], file_name, executor)
+            completed.add(i)
+            progress = {"progress": (len(completed) / len(files)) * 100, "completed_files": sorted(completed)}
+
+            if chunks:
+                logging.info(f"Generating embeddings for {len(chunks)} chunks of {file_name}...")
+                await self.state.update_job(job_id, status=f"Generating embeddings for {len(chunks)} chunks of {file_name}...")
+                embeddings = await self._encode([chunk["content"] for chunk in chunks], executor)
+                for chunk, embedding in zip(chunks, embeddings):
+                    chunk["embedding"] = embedding
+
+                # Atomically update the shared chunk store and the job's progress, then refresh the local mirror
+                await self.state.add_chunks(chunks, job_id, **progress)
+                await self.sync_chunks()
+                logging.info(f"Added {len(chunks)} new chunks to the store.")
+            else:
+                await self.state.update_job(job_id, **progress)
+
+        await self.state.update_job(
+            job_id, status="Completed", message=f"Successfully processed {len(files)} documents."
+        )
 
     async def search_documents(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
         """
@@ -150,19 +230,12 @@ class DocumentProcessor:
             return []
 
         query_embedding = await asyncio.to_thread(model.encode, [query])
-        
-        # This is computationally expensive for large stores. A real vector DB would index this.
-        chunk_embeddings = [chunk["embedding"] for chunk in self.chunk_store]
-        
-        # Using numpy for similarity calculation
-        import numpy as np
-        from sklearn.metrics.pairwise import cosine_similarity
 
-        similarities = cosine_similarity(query_embedding, np.array(chunk_embeddings))[0]
-        top_k_indices = similarities.argsort()[-top_k:][::-1]
+        # Approximate search over the compact matrix, exact re-scoring of the best candidates
+        matches = self.embedding_index.search(query_embedding[0], top_k)
 
         return [{
             "file_path": self.chunk_store[i]["file_path"],
             "content": self.chunk_store[i]["content"],
-            "similarity": float(similarities[i])
-        } for i in top_k_indices]
+            "similarity": similarity
+        } for i, similarity in matches]
@@ -0,0 +1,178 @@
+import os
+import tempfile
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Storage precision for embeddings: "int8" (per-vector scaled), "float16" or "float32"
+# (no compression). Quantized searches exactly re-score the best
+# `top_k * EMBEDDING_RESCORE_FACTOR` candidates against full-precision vectors.
+# int8 is the default: it is the smallest and also the fastest to search, since numpy
+# converts int8 blocks to float32 much faster than float16 ones.
+EMBEDDING_PRECISION = os.getenv("EMBEDDING_PRECISION", "int8").lower()
+EMBEDDING_RESCORE_FACTOR = int(os.getenv("EMBEDDING_RESCORE_FACTOR", 4))
+
+PRECISIONS = ("float32", "float16", "int8")
+
+# Rows are converted to float32 in blocks of this size when scoring, which bounds
+# the temporary memory used by a search.
+_SCORE_BLOCK_ROWS = 8192
+
+
+class EmbeddingIndex:
+    """
+    A packed, optionally quantized matrix of L2-normalised embeddings supporting cosine
+    similarity search.
+
+    With float16 or int8 precision, only the compact matrix is kept in memory. The
+    full-precision rows are appended to an anonymous temporary file and read back only
+    for the small candidate set that is exactly re-scored after the approximate pass.
+
+    Rows are stored in buffers whose capacity doubles as they fill, so adding many
+    small batches costs amortised linear time.
+    """
+    def __init__(self, precision: str = None, rescore_factor: int = None):
+        self.precision = (precision or EMBEDDING_PRECISION).lower()
+        if self.precision not in PRECISIONS:
+            raise ValueError(f"Unknown embedding precision '{self.precision}'. Expected one of {PRECISIONS}.")
+        self.rescore_factor = rescore_factor or EMBEDDING_RESCORE_FACTOR
+        self.dim: Optional[int] = None
+        # Rows [0, _size) of the buffers are in use; the rest is spare capacity
+        self._size = 0
+        self._buffer: Optional[np.ndarray] = None
+        self._scale_buffer: Optional[np.ndarray] = None
+        self._exact_file = None if self.precision == "float32" else tempfile.TemporaryFile()
+        self._file_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def _matrix(self) -> Optional[np.ndarray]:
+        return None if self._buffer is None else self._buffer[:self._size]
+
+    @property
+    def _scales(self) -> Optional[np.ndarray]:
+        return None if self._scale_buffer is None else self._scale_buffer[:self._size]
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held in memory by the (quantized) matrix and its scales, including spare capacity."""
+        size = 0 if self._buffer is None else self._buffer.nbytes
+        if self._scale_buffer is not None:
+            size += self._scale_buffer.nbytes
+        return size
+
+    def add(self, embeddings):
+        """Appends a batch of embeddings (any array-like of shape (n, dim))."""
+        if len(embeddings) == 0:
+            return
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of dimension {self.dim}, got {vectors.shape[1]}.")
+
+        if self.precision == "float32":
+            packed, scales = vectors, None
+        elif self.precision == "float16":
+            packed, scales = vectors.astype(np.float16), None
+        else:
+            packed, scales = _quantize_int8(vectors)
+
+        if self._exact_file is not None:
+            with self._file_lock:
+                self._exact_file.seek(0, os.SEEK_END)
+                self._exact_file.write(vectors.tobytes())
+
+        size = self._size + len(packed)
+        self._buffer = _ensure_capacity(self._buffer, size, packed)
+        self._buffer[self._size:size] = packed
+        if scales is not None:
+            self._scale_buffer = _ensure_capacity(self._scale_buffer, size, scales)
+            self._scale_buffer[self._size:size] = scales
+        self._size = size
+
+    def search(self, query, top_k: int = 5, rescore_k: int = None) -> List[Tuple[int, float]]:
+        """
+        Returns up to `top_k` `(row, cosine_similarity)` pairs, best first. The best
+        `rescore_k` approximate candidates (default `top_k * rescore_factor`) are
+        re-scored exactly; any remaining results keep their approximate scores.
+        """
+        if not len(self):
+            return []
+        query = _normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        scores = self._approximate_scores(query)
+
+        top_k = min(top_k, len(scores))
+        if self._exact_file is None:
+            candidates = _top_indices(scores, top_k)
+            return [(int(i), float(scores[i])) for i in candidates]
+
+        rescore_k = min(len(scores), max(top_k, rescore_k or top_k * self.rescore_factor))
+        candidates = _top_indices(scores, rescore_k)
+        exact_scores = self._exact_rows(candidates) @ query
+        results = [(int(i), float(score)) for i, score in zip(candidates, exact_scores)]
+        results.sort(key=lambda item: item[1], reverse=True)
+
+        if top_k > rescore_k:
+            rest = np.argsort(-scores)[rescore_k:top_k]
+            results.extend((int(i), float(scores[i])) for i in rest)
+        return results[:top_k]
+
+    def close(self):
+        if self._exact_file is not None:
+            self._exact_file.close()
+            self._exact_file = None
+
+    def _approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), _SCORE_BLOCK_ROWS):
+            block = self._matrix[start:start + _SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[start:start + len(block)] = block @ query
+        if self._scales is not None:
+            scores *= self._scales
+        return scores
+
+    def _exact_rows(self, rows: np.ndarray) -> np.ndarray:
+        row_bytes = self.dim * 4
+        chunks = []
+        with self._file_lock:
+            for row in rows:
+                self._exact_file.seek(int(row) * row_bytes)
+                chunks.append(self._exact_file.read(row_bytes))
+        buffer = b"".join(chunks)
+        return np.frombuffer(buffer, dtype=np.float32).reshape(len(rows), self.dim)
+
+
+def _ensure_capacity(buffer: Optional[np.ndarray], rows: int, like: np.ndarray) -> np.ndarray:
+    """Returns `buffer`, or a copy grown to at least twice its capacity if it holds fewer than `rows` rows."""
+    if buffer is not None and len(buffer) >= rows:
+        return buffer
+    capacity = rows if buffer is None else max(rows, 2 * len(buffer))
+    grown = np.empty((capacity,) + like.shape[1:], dtype=like.dtype)
+    if buffer is not None:
+        grown[:len(buffer)] = buffer
+    return grown
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-vector int8 quantization: v ~= q * scale with q in [-127, 127]."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def _top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    if k >= len(scores):
+        return np.argsort(-scores)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
@@ -0,0 +1,27 @@
+import logging
+import threading
+
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+
+# Lazy loading for sentence-transformers model. The import itself pulls in torch and
+# takes seconds, so it is deferred until the model is first needed (normally during
+# the background warm-up). One instance is shared by document and schema processing.
+_model = None
+_model_lock = threading.Lock()
+
+def get_sentence_transformer_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    _model = SentenceTransformer(MODEL_NAME)
+                    logging.info("SentenceTransformer model loaded.")
+                except ImportError:
+                    logging.error("sentence-transformers library not found. Please install it.")
+                    return None
+    return _model
+
+def is_model_loaded() -> bool:
+    return _model is not None
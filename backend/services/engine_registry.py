@@ -0,0 +1,244 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, defaultdict
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from services.query_engine import QueryEngine
+from services.document_processor import DocumentProcessor
+from services.state_backend import StateBackend, DATABASES_TOPIC
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_DATABASE = "default"
+# Warm engines are evicted, least recently used first, while their estimated memory
+# exceeds this budget. The default database and engines serving a query are never evicted.
+ENGINE_MEMORY_BUDGET_MB = float(os.getenv("ENGINE_MEMORY_BUDGET_MB", 256))
+
+
+class DatabaseConnectionError(Exception):
+    """Raised when a database cannot be connected to or its schema cannot be analyzed."""
+
+
+class UnknownDatabaseError(Exception):
+    """Raised when no database is registered under the requested name."""
+
+
+class EngineRegistry:
+    """
+    Keeps a warm `QueryEngine` per named database, each with its own connection pool and
+    schema embeddings, all sharing one document processor.
+
+    Databases are recorded in the state backend, so an engine evicted here, or connected
+    through another worker, is warmed again on first use.
+    """
+    def __init__(self, document_processor: DocumentProcessor, state: StateBackend, memory_budget_mb: float = ENGINE_MEMORY_BUDGET_MB):
+        self.document_processor = document_processor
+        self.state = state
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self._engines: "OrderedDict[str, QueryEngine]" = OrderedDict()
+        self._in_use: Dict[str, int] = defaultdict(int)
+        # Queries in flight per engine, and replaced engines to close once theirs finish
+        self._engine_users: Dict[QueryEngine, int] = defaultdict(int)
+        self._retired: Set[QueryEngine] = set()
+        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # Called with the database name whenever an engine has been (re)warmed
+        self.on_warm: Optional[Callable[[str], None]] = None
+        self.state.subscribe(DATABASES_TOPIC, self._on_databases_changed)
+
+    async def connect(self, name: str, connection_string: str, refresh: bool = True) -> QueryEngine:
+        """
+        Creates and warms an engine for `connection_string` under `name`. An existing
+        engine with that name keeps serving until the new one is ready, and is closed
+        once the queries it is running have finished.
+
+        With `refresh` (the default, for an explicit connect) results cached for the
+        database are dropped. Startup passes False, so a worker starting does not wipe
+        the cache its siblings share.
+        """
+        async with self._locks[name]:
+            return await self._connect(name, connection_string, refresh=refresh)
+
+    async def _connect(self, name: str, connection_string: str, refresh: bool = False) -> QueryEngine:
+        """
+        Warms an engine under `name`. With `refresh` (an explicit connect, i.e. a schema
+        reload), results cached for this database are dropped, also for other workers.
+        """
+        start = time.perf_counter()
+        engine = QueryEngine(connection_string, self.document_processor, self.state)
+        await engine.initialize()
+        if "error" in engine.schema:
+            await engine.close()
+            raise DatabaseConnectionError(engine.schema["error"])
+
+        old_engine = self._engines.pop(name, None)
+        self._engines[name] = engine
+        await self.state.set_database(name, connection_string)
+        if old_engine is not None:
+            await self._retire(old_engine)
+        if refresh:
+            await engine.cache.clear_namespace()
+        logging.info(f"Database '{name}' warmed in {time.perf_counter() - start:.2f}s.")
+        await self._evict(protect=name)
+        if self.on_warm is not None:
+            self.on_warm(name)
+        return engine
+
+    async def get(self, name: Optional[str] = None) -> QueryEngine:
+        """
+        Returns the warm engine for `name` (the default database if None), warming it
+        from its registered connection string if needed. Raises UnknownDatabaseError for
+        names that are not registered.
+        """
+        name = name or DEFAULT_DATABASE
+        engine = self._engines.get(name)
+        if engine is not None:
+            self._engines.move_to_end(name)
+            return engine
+
+        async with self._locks[name]:
+            if name in self._engines:
+                return self._engines[name]
+            connection_string = (await self.state.get_databases()).get(name)
+            if connection_string is None:
+                raise UnknownDatabaseError(f"Unknown database '{name}'.")
+            logging.info(f"Warming database '{name}' on demand.")
+            return await self._connect(name, connection_string)
+
+    @asynccontextmanager
+    async def use(self, name: Optional[str] = None):
+        """Yields the engine for `name`, protecting it from eviction while in use."""
+        engine = await self.get(name)
+        name = name or DEFAULT_DATABASE
+        self._in_use[name] += 1
+        self._engine_users[engine] += 1
+        try:
+            yield engine
+        finally:
+            self._in_use[name] -= 1
+            self._engine_users[engine] -= 1
+            if not self._engine_users[engine]:
+                del self._engine_users[engine]
+                if engine in self._retired:
+                    self._retired.discard(engine)
+                    await engine.close()
+
+    async def query(self, query: str, name: Optional[str] = None) -> Dict[str, Any]:
+        """Runs a query against one database."""
+        async with AsyncExitStack() as stack:
+            try:
+                engine = await stack.enter_async_context(self.use(name))
+            except UnknownDatabaseError as e:
+                return {"error": str(e)}
+            except DatabaseConnectionError as e:
+                return {"error": f"Database '{name or DEFAULT_DATABASE}' is unavailable: {e}"}
+            return await engine.process_query(query)
+
+    async def fan_out(self, query: str, names: List[str]) -> Dict[str, Any]:
+        """
+        Runs a query against several databases concurrently and merges the results.
+        SQL rows are concatenated and tagged with their "database". The document
+        results are shared by all databases, so they are returned once.
+        """
+        start_time = time.time()
+        results = await asyncio.gather(*(self.query(query, name) for name in names))
+        per_database = dict(zip(names, results))
+
+        rows, generated_sql, errors = [], {}, {}
+        doc_result = None
+        for name, result in per_database.items():
+            if "error" in result:
+                errors[name] = result["error"]
+                continue
+            sql_result = result.get("sql_result") or {}
+            if "error" in sql_result:
+                errors[name] = sql_result["error"]
+            if sql_result.get("generated_sql"):
+                generated_sql[name] = sql_result["generated_sql"]
+            rows.extend({"database": name, **row} for row in sql_result.get("data", []))
+            if doc_result is None:
+                doc_result = result.get("doc_result")
+
+        merged = {
+            "type": "multi",
+            "databases": names,
+            "sql_result": {"generated_sql": generated_sql, "data": rows},
+            "doc_result": doc_result,
+            "results": per_database,
+            "performance_metrics": {"response_time": time.time() - start_time},
+        }
+        if errors:
+            merged["errors"] = errors
+            if len(errors) == len(names):
+                merged["error"] = "Query failed on every database."
+        return merged
+
+    async def describe(self) -> List[Dict[str, Any]]:
+        """Lists registered databases and whether each is warm in this worker."""
+        databases = await self.state.get_databases()
+        return [{
+            "name": name,
+            "warm": name in self._engines,
+            "in_use": self._in_use.get(name, 0),
+            "memory_bytes": self._engines[name].estimated_memory_bytes() if name in self._engines else 0,
+            "cache": self._engines[name].cache.stats if name in self._engines else None,
+        } for name in sorted(databases)]
+
+    def warm_databases(self) -> List[str]:
+        return list(self._engines)
+
+    def active_queries(self) -> int:
+        """Number of queries currently being served by this worker."""
+        return sum(self._in_use.values())
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Cache lookup counters summed over the warm engines of this worker."""
+        totals = {"hits": 0, "misses": 0, "prewarmed_hits": 0}
+        for engine in self._engines.values():
+            for key in totals:
+                totals[key] += engine.cache.stats[key]
+        lookups = totals["hits"] + totals["misses"]
+        totals["hit_rate"] = totals["hits"] / lookups if lookups else 0.0
+        return totals
+
+    async def close(self):
+        for engine in list(self._engines.values()) + list(self._retired):
+            await engine.close()
+        self._engines.clear()
+        self._retired.clear()
+
+    async def _retire(self, engine: QueryEngine):
+        """Closes a replaced engine now if it is idle, otherwise when its last query finishes."""
+        # Results of queries still running on the old schema must not refill the cache
+        engine.cache.writable = False
+        if self._engine_users.get(engine):
+            self._retired.add(engine)
+        else:
+            await engine.close()
+
+    async def _evict(self, protect: Optional[str] = None):
+        """Evicts idle engines, least recently used first, until within the memory budget."""
+        usage = {name: engine.estimated_memory_bytes() for name, engine in self._engines.items()}
+        total = sum(usage.values())
+        for name in list(self._engines):
+            if total <= self.memory_budget:
+                break
+            if name in (DEFAULT_DATABASE, protect) or self._in_use.get(name):
+                continue
+            engine = self._engines.pop(name)
+            total -= usage[name]
+            await self._retire(engine)
+            logging.info(f"Evicted idle database '{name}' ({usage[name]} bytes) to stay within the memory budget.")
+
+    async def _on_databases_changed(self):
+        """Drops warm engines whose connection string was changed by another worker."""
+        databases = await self.state.get_databases()
+        for name, engine in list(self._engines.items()):
+            if databases.get(name) not in (None, engine.connection_string):
+                async with self._locks[name]:
+                    if self._engines.get(name) is engine:
+                        del self._engines[name]
+                        await self._retire(engine)
+                        logging.info(f"Database '{name}' was reconnected elsewhere; it will be warmed again on use.")
@@ -0,0 +1,415 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.document_processor import DocumentProcessor
+from services.state_backend import StateBackend
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Ingestion runs on its own bounded resources so that it cannot starve query serving:
+# at most INGEST_MAX_WORKERS jobs run at once, their text extraction and embedding calls
+# share a pool of INGEST_PROCESSES worker processes (each loading its own embedding model)
+# whose torch intra-op parallelism is capped at INGEST_TORCH_THREADS threads, and at most
+# INGEST_MAX_QUEUE jobs may wait.
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", 2))
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", 1))
+INGEST_TORCH_THREADS = int(os.getenv("INGEST_TORCH_THREADS", 1))
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", 20))
+# Finished jobs kept in the status store (older ones are pruned with their files)
+INGEST_MAX_FINISHED_JOBS = int(os.getenv("INGEST_MAX_FINISHED_JOBS", 200))
+# How often a running job checks for a cancellation requested through another worker
+CANCEL_POLL_INTERVAL = 1.0
+# Each process stamps a heartbeat on the jobs it owns every INGEST_HEARTBEAT_INTERVAL
+# seconds. Unfinished jobs whose owner missed heartbeats for INGEST_JOB_STALE_AFTER seconds,
+# or whose owner process on this host is gone, are marked failed so they can be resumed.
+INGEST_HEARTBEAT_INTERVAL = float(os.getenv("INGEST_HEARTBEAT_INTERVAL", 10))
+INGEST_JOB_STALE_AFTER = float(os.getenv("INGEST_JOB_STALE_AFTER", 60))
+
+DEFAULT_PRIORITY = 5
+FINISHED_STATUSES = ("Completed", "Failed", "Cancelled")
+RESUMABLE_STATUSES = ("Failed", "Cancelled")
+
+
+class QueueFullError(Exception):
+    """Raised when the ingestion queue cannot accept another job."""
+
+
+class JobStateError(Exception):
+    """Raised when a job cannot be cancelled or resumed in its current state."""
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def init_ingest_process(torch_threads: int):
+    """Limits the CPU threads of an ingestion worker process before torch is loaded."""
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[variable] = str(torch_threads)
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+
+
+class IngestionScheduler:
+    """
+    Runs document ingestion jobs from a bounded priority queue (lower number runs first)
+    with a fixed number of workers, separate from the request handlers.
+
+    Job status lives in the state backend so any worker can report on it. Cancelled or
+    failed jobs keep their uploaded files and can be resumed; already processed files
+    are skipped. Files are deleted once a job completes or is pruned.
+
+    Each job records its owning scheduler ("_owner") and a heartbeat ("_heartbeat"), so
+    jobs left queued or running by a worker that died are detected by the others and
+    marked as interrupted.
+
+    A job may be submitted while its upload is still being received: files are added
+    with add_file as they arrive and the job waits for more until finish_upload.
+    """
+    def __init__(
+        self,
+        state: StateBackend,
+        max_workers: int = INGEST_MAX_WORKERS,
+        max_queue: int = INGEST_MAX_QUEUE,
+        processes: int = INGEST_PROCESSES,
+        torch_threads: int = INGEST_TORCH_THREADS,
+        max_finished_jobs: int = INGEST_MAX_FINISHED_JOBS
+    ):
+        self.state = state
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_finished_jobs = max_finished_jobs
+        self.processes = processes
+        self.torch_threads = torch_threads
+        self.executor = self._create_executor()
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        # job_id -> (document_processor, files) for jobs queued or running in this process
+        self._pending: Dict[str, Tuple[Any, List[Dict[str, Any]]]] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        # job_id -> condition notified as files arrive, for jobs whose upload is still open
+        self._uploads: Dict[str, asyncio.Condition] = {}
+        self._workers: List[asyncio.Task] = []
+        self._heartbeat: Optional[asyncio.Task] = None
+        # Set by stop(), so that jobs cancelled by a shutdown are marked interrupted, not cancelled
+        self._stopping = False
+        # host:pid:instance, so that a restarted process on the same host is told apart
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Called with the job id after a job completes and the query cache was cleared
+        self.on_job_completed: Optional[Callable[[str], None]] = None
+
+    @property
+    def queued(self) -> int:
+        return len(self._pending) - len(self._running)
+
+    def is_full(self) -> bool:
+        return self.queued >= self.max_queue
+
+    async def start(self):
+        await self.recover_interrupted_jobs()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        """
+        Stops the workers. Jobs this process was running or had queued are marked
+        failed and interrupted, so they can be resumed; this waits for the running
+        ones to record that before returning.
+        """
+        self._stopping = True
+        running = dict(self._running)
+        tasks = self._workers + list(running.values())
+        if self._heartbeat is not None:
+            tasks.append(self._heartbeat)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Jobs still queued here, and running jobs cancelled before they got to record it
+        interrupted = list(self._pending) + [job_id for job_id, task in running.items() if task.cancelled()]
+        self._pending.clear()
+        for job_id in interrupted:
+            await self._mark_interrupted(job_id, "the server shut down while this job was queued or running")
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(
+        self,
+        job_id: str,
+        document_processor: DocumentProcessor,
+        files: List[Dict[str, Any]],
+        priority: int = DEFAULT_PRIORITY,
+        uploading: bool = False
+    ):
+        """
+        Queues a new job for the uploaded `files` (as returned by the upload handler).
+        With `uploading`, more files may still be added with add_file, and the job does
+        not complete before finish_upload is called.
+        Raises QueueFullError if INGEST_MAX_QUEUE jobs are already waiting.
+        """
+        if self.is_full():
+            raise QueueFullError(f"Ingestion queue is full ({self.max_queue} jobs waiting).")
+        files = list(files)
+        await self.state.set_job(job_id, {
+            "status": "Queued",
+            "progress": 0,
+            "message": "Waiting for an ingestion worker.",
+            "priority": priority,
+            "uploading": uploading,
+            "completed_files": [],
+            **self._file_fields(files),
+            "_owner": self.owner_id,
+            "_heartbeat": time.time(),
+        })
+        if uploading:
+            self._uploads[job_id] = asyncio.Condition()
+        self._enqueue(job_id, document_processor, files, priority)
+
+    async def add_file(self, job_id: str, file_info: Dict[str, Any]):
+        """Adds an uploaded file to a job submitted with `uploading` that is still open."""
+        condition = self._uploads.get(job_id)
+        if condition is None or job_id not in self._pending:
+            raise JobStateError("Job is no longer accepting files.")
+        files = self._pending[job_id][1]
+        files.append(file_info)
+        await self.state.update_job(job_id, **self._file_fields(files))
+        async with condition:
+            condition.notify_all()
+
+    async def finish_upload(self, job_id: str):
+        """Marks the upload of a job as complete, so it finishes after its last file."""
+        await self.state.update_job(job_id, uploading=False)
+        await self._close_upload(job_id)
+
+    async def abort_upload(self, job_id: str, reason: str):
+        """
+        Stops a job whose upload failed part-way. Files it already processed stay indexed;
+        the job is marked failed and cannot be resumed, as its file list is incomplete.
+        The caller removes the uploaded files.
+        """
+        await self._close_upload(job_id)
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.wait({task})
+        self._pending.pop(job_id, None)
+        await self.state.update_job(
+            job_id, status="Failed", message=f"Upload failed: {reason}", _cancel_requested=False
+        )
+
+    async def _close_upload(self, job_id: str):
+        condition = self._uploads.pop(job_id, None)
+        if condition is not None:
+            async with condition:
+                condition.notify_all()
+
+    async def _wait_for_files(self, job_id: str, files: List[Dict[str, Any]], seen: int) -> bool:
+        """Waits until the job has more than `seen` files or its upload is complete."""
+        condition = self._uploads.get(job_id)
+        if condition is not None and len(files) <= seen:
+            await self.state.update_job(job_id, status="Waiting for more files to be uploaded...")
+            async with condition:
+                await condition.wait_for(lambda: len(files) > seen or job_id not in self._uploads)
+        return len(files) > seen
+
+    @staticmethod
+    def _file_fields(files: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "files": [{key: f[key] for key in ("filename", "size", "sha256")} for f in files],
+            "_files": [{"path": f["path"], "filename": f["filename"]} for f in files],
+        }
+
+    async def cancel(self, job_id: str) -> Dict[str, Any]:
+        """Cancels a queued or running job. Its files are kept so it can be resumed."""
+        job = await self.state.get_job(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job.get("status") in FINISHED_STATUSES:
+            raise JobStateError(f"Job is already {job['status'].lower()}.")
+
+        if job_id in self._running:
+            task = self._running[job_id]
+            task.cancel()
+            # Give the job a moment to stop so the response reflects it
+            await asyncio.wait({task}, timeout=CANCEL_POLL_INTERVAL)
+        elif job_id in self._pending:
+            self._pending.pop(job_id)
+            await self._mark_cancelled(job_id)
+        elif self._is_stale(job):
+            # Its owner is gone, so nobody would act on a cancellation request
+            await self._mark_cancelled(job_id)
+        else:
+            # Owned by another worker process, which polls for this flag
+            await self.state.update_job(job_id, _cancel_requested=True, message="Cancellation requested.")
+        return await self.state.get_job(job_id)
+
+    async def resume(self, job_id: str, document_processor: DocumentProcessor, priority: Optional[int] = None) -> Dict[str, Any]:
+        """Re-queues a cancelled or failed job; files already processed are skipped."""
+        job = await self.state.get_job(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job.get("status") not in RESUMABLE_STATUSES:
+            raise JobStateError(f"Only failed or cancelled jobs can be resumed (job is {job.get('status')}).")
+        if job.get("uploading"):
+            raise JobStateError("The upload of this job did not finish; upload the files again.")
+        if self.is_full():
+            raise QueueFullError(f"Ingestion queue is full ({self.max_queue} jobs waiting).")
+
+        files = [dict(f) for f in job.get("_files", []) if os.path.exists(f["path"])]
+        if len(files) != len(job.get("_files", [])):
+            raise JobStateError("Uploaded files for this job are no longer available.")
+        priority = job.get("priority", DEFAULT_PRIORITY) if priority is None else priority
+        await self.state.update_job(
+            job_id, status="Queued", message="Resumed; waiting for an ingestion worker.",
+            priority=priority, interrupted=False, _cancel_requested=False,
+            _owner=self.owner_id, _heartbeat=time.time()
+        )
+        self._enqueue(job_id, document_processor, files, priority)
+        return await self.state.get_job(job_id)
+
+    def _enqueue(self, job_id: str, document_processor: DocumentProcessor, files: List[Dict[str, Any]], priority: int):
+        self._pending[job_id] = (document_processor, files)
+        self._queue.put_nowait((priority, next(self._sequence), job_id))
+
+    async def _worker(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            if job_id not in self._pending or job_id in self._running:
+                continue # Cancelled while queued, or a stale entry of a resumed job
+            document_processor, files = self._pending[job_id]
+            job = await self.state.get_job(job_id)
+            if job and job.get("_cancel_requested"):
+                del self._pending[job_id]
+                await self._mark_cancelled(job_id)
+                continue
+            task = asyncio.create_task(self._run(job_id, document_processor, files))
+            self._running[job_id] = task
+            watcher = asyncio.create_task(self._watch_cancellation(job_id, task))
+            try:
+                await asyncio.wait({task})
+            finally:
+                watcher.cancel()
+                self._running.pop(job_id, None)
+                self._pending.pop(job_id, None)
+            await self._prune()
+
+    async def _run(self, job_id: str, document_processor: DocumentProcessor, files: List[Dict[str, Any]]):
+        job = await self.state.get_job(job_id) or {}
+        try:
+            await document_processor.process_documents(
+                files, job_id, completed=job.get("completed_files"), executor=self.executor,
+                wait_for_files=lambda seen: self._wait_for_files(job_id, files, seen)
+            )
+            # Cached document and hybrid answers no longer reflect the corpus
+            await self.state.cache_clear()
+        except asyncio.CancelledError:
+            if self._stopping:
+                await self._mark_interrupted(job_id, "the server shut down while this job was running")
+            else:
+                await self._mark_cancelled(job_id)
+            return
+        except Exception as e:
+            logging.error(f"Ingestion job {job_id} failed: {e}")
+            if isinstance(e, BrokenProcessPool):
+                # A worker process died (e.g. out of memory); later jobs get a fresh pool
+                self.executor = self._create_executor()
+            await self.state.update_job(job_id, status="Failed", message=str(e) or type(e).__name__)
+            return
+
+        # Completed jobs cannot be resumed, so their files are no longer needed
+        for file_info in files:
+            remove_file(file_info["path"])
+        if self.on_job_completed is not None:
+            self.on_job_completed(job_id)
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # "spawn" avoids forking a process whose torch and BLAS thread pools are already running
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_ingest_process,
+            initargs=(self.torch_threads,)
+        )
+
+    async def _watch_cancellation(self, job_id: str, task: asyncio.Task):
+        while not task.done():
+            await asyncio.sleep(CANCEL_POLL_INTERVAL)
+            job = await self.state.get_job(job_id)
+            if job and job.get("_cancel_requested"):
+                task.cancel()
+                return
+
+    async def _mark_cancelled(self, job_id: str):
+        await self.state.update_job(
+            job_id, status="Cancelled", message="Job cancelled. It can be resumed.", _cancel_requested=False
+        )
+
+    async def _mark_interrupted(self, job_id: str, reason: str):
+        await self.state.update_job(
+            job_id, status="Failed", interrupted=True, _cancel_requested=False,
+            message=f"Interrupted: {reason}. It can be resumed."
+        )
+
+    async def recover_interrupted_jobs(self):
+        """Marks unfinished jobs whose owner has stopped sending heartbeats as interrupted."""
+        jobs = await self.state.get_jobs(exclude_statuses=FINISHED_STATUSES)
+        for job_id, job in jobs.items():
+            if job.get("_owner") == self.owner_id or not self._is_stale(job):
+                continue
+            # Re-check right before writing, in case the owner has just sent a heartbeat
+            job = await self.state.get_job(job_id)
+            if job and job.get("status") not in FINISHED_STATUSES and self._is_stale(job):
+                logging.warning(f"Ingestion job {job_id} was interrupted (owner {job.get('_owner')} is gone).")
+                await self._mark_interrupted(job_id, "the worker running this job stopped")
+
+    def _is_stale(self, job: Dict[str, Any]) -> bool:
+        owner = job.get("_owner")
+        if owner == self.owner_id:
+            return False
+        if time.time() - job.get("_heartbeat", 0) > INGEST_JOB_STALE_AFTER:
+            return True
+        # A job owned by another scheduler on this host is stale as soon as its process has exited
+        host, _, rest = (owner or "").partition(":")
+        pid, _, _ = rest.partition(":")
+        if host != socket.gethostname() or not pid.isdigit():
+            return False
+        if int(pid) == os.getpid():
+            return True # An earlier scheduler instance of this process
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass # Exists, but owned by another user
+        return False
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(INGEST_HEARTBEAT_INTERVAL)
+            try:
+                for job_id in list(self._pending):
+                    await self.state.update_job(job_id, _heartbeat=time.time())
+                await self.recover_interrupted_jobs()
+            except Exception as e:
+                logging.error(f"Ingestion heartbeat failed: {e}")
+
+    async def _prune(self):
+        """Keeps the status store bounded, deleting the retained files of pruned jobs."""
+        await self.recover_interrupted_jobs()
+        removed = await self.state.prune_jobs(self.max_finished_jobs, FINISHED_STATUSES)
+        for job in removed:
+            for file_info in job.get("_files", []):
+                remove_file(file_info["path"])
@@ -1,16 +1,16 @@
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
+from services.embedding_model import get_sentence_transformer_model
 
 class NLMapper:
     def __init__(self, schema: dict):
         self.schema = schema
-        self.model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+        self.model = get_sentence_transformer_model()
 
     def map_natural_language_to_schema(self, query: str) -> dict:
         """
         Map user's natural language to actual database structure using semantic similarity.
         """
+        from sklearn.metrics.pairwise import cosine_similarity
+
         query_embedding = self.model.encode([query])
 
         best_match = {
@@ -1,31 +1,55 @@
 import time
+from typing import Optional
+
+from services.state_backend import StateBackend, InMemoryStateBackend
 
 class QueryCache:
-    def __init__(self, ttl_seconds: int = 300, max_size: int = 1000):
-        self.cache = {}
+    def __init__(self, ttl_seconds: int = 300, max_size: int = 1000, backend: Optional[StateBackend] = None, namespace: str = ""):
+        # The backend decides where entries live; with a shared backend all workers see one cache.
+        # The namespace keeps entries of different databases apart in a shared backend.
+        self.backend = backend or InMemoryStateBackend()
         self.ttl_seconds = ttl_seconds
         self.max_size = max_size
+        self.namespace = namespace
+        # Cleared when the engine owning this cache is replaced, so it stops storing results
+        self.writable = True
+        # Per-process lookup counters. "prewarmed_hits" counts hits on entries stored by
+        # the cache prewarmer rather than by a user query.
+        self.stats = {"hits": 0, "misses": 0, "prewarmed_hits": 0}
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}" if self.namespace else key
 
-    def get(self, key: str):
-        if key in self.cache:
-            entry = self.cache[key]
-            if time.time() - entry["timestamp"] < self.ttl_seconds:
-                return entry["value"]
+    async def get(self, key: str, record: bool = True):
+        """Returns the cached value or None. Pass `record=False` to leave the stats untouched."""
+        entry = await self.backend.cache_get(self._key(key))
+        if entry is not None:
+            value, timestamp, prewarmed = entry
+            if time.time() - timestamp < self.ttl_seconds:
+                if record:
+                    self.stats["hits"] += 1
+                    if prewarmed:
+                        self.stats["prewarmed_hits"] += 1
+                return value
             else:
                 # Entry expired
-                del self.cache[key]
+                await self.backend.cache_delete(self._key(key))
+        if record:
+            self.stats["misses"] += 1
         return None
 
-    def set(self, key: str, value: any):
-        if len(self.cache) >= self.max_size:
-            # Simple eviction policy: remove the oldest entry
-            oldest_key = min(self.cache, key=lambda k: self.cache[k]["timestamp"])
-            del self.cache[oldest_key]
-        self.cache[key] = {"value": value, "timestamp": time.time()}
+    async def set(self, key: str, value: any, prewarmed: bool = False):
+        if not self.writable:
+            return
+        await self.backend.cache_set(self._key(key), value, self.max_size, prewarmed)
+
+    async def invalidate(self, key: str):
+        await self.backend.cache_delete(self._key(key))
 
-    def invalidate(self, key: str):
-        if key in self.cache:
-            del self.cache[key]
+    async def clear(self):
+        # Clears every namespace: document changes affect the answers for all databases
+        await self.backend.cache_clear()
 
-    def clear(self):
-        self.cache = {}
\ No newline at end of file
+    async def clear_namespace(self):
+        """Clears only this cache's namespace (all entries if it has none)."""
+        await self.backend.cache_clear(f"{self.namespace}:" if self.namespace else "")
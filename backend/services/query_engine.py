@@ -1,7 +1,11 @@
+import os
+import json
 import logging
 import time
 import asyncio
+import hashlib
 import re
+from typing import Any, Dict, Optional, Tuple
 
 from sqlalchemy import create_engine, text
 from sqlalchemy.ext.asyncio import create_async_engine
@@ -9,24 +13,38 @@ from sqlalchemy.ext.asyncio import create_async_engine
 from services.schema_discovery import SchemaDiscovery
 from services.document_processor import DocumentProcessor
 from services.query_cache import QueryCache
+from services.state_backend import StateBackend
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+NUMERIC_TYPE_PATTERN = re.compile(r'INT|NUM|DEC|REAL|FLOAT|DOUBLE', re.IGNORECASE)
+
+# Connection pool settings for server databases (SQLite uses SQLAlchemy's defaults)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+
 class QueryEngine:
     """
     Orchestrates query processing by classifying queries, generating SQL,
     searching documents, and caching results.
     """
-    def __init__(self, connection_string: str, document_processor: DocumentProcessor):
+    def __init__(self, connection_string: str, document_processor: DocumentProcessor, state_backend: StateBackend = None):
         self.connection_string = connection_string
         self.schema_discovery = SchemaDiscovery()
         self.document_processor = document_processor
-        self.cache = QueryCache()
+        # Cache entries are namespaced per database, without putting credentials in the keys
+        namespace = hashlib.sha1(connection_string.encode()).hexdigest()[:12]
+        self.cache = QueryCache(backend=state_backend or document_processor.state, namespace=namespace)
         self.schema = {}
+        self.async_engine = None
 
     async def initialize(self):
         """Asynchronously connects to the DB and analyzes the schema."""
-        self.async_engine = create_async_engine(self.connection_string)
+        pool_options = {"pool_pre_ping": True}
+        if not self.connection_string.startswith("sqlite"):
+            pool_options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE)
+        self.async_engine = create_async_engine(self.connection_string, **pool_options)
         try:
             async with self.async_engine.connect():
                 logging.info("Database connection successful.")
@@ -40,6 +58,17 @@ class QueryEngine:
             logging.error(f"Database initialization failed: {e}")
             self.schema = {"error": str(e)}
 
+    async def close(self):
+        """Releases the connection pool and the schema embeddings."""
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
+            self.async_engine = None
+        self.schema_discovery.column_index.close()
+
+    def estimated_memory_bytes(self) -> int:
+        """Approximate memory held by this engine's schema and its indexes."""
+        return len(json.dumps(self.schema, default=str)) + self.schema_discovery.estimated_memory_bytes()
+
     def _classify_query(self, query: str) -> str:
         """Classifies a query as SQL, document search, or hybrid."""
         query_lower = query.lower()
@@ -57,16 +86,16 @@ class QueryEngine:
         # If keywords from both are present, or none are, default to hybrid
         return "hybrid"
 
-    def _generate_sql(self, mapping: dict) -> str:
+    def _generate_sql(self, mapping: dict) -> Tuple[Optional[str], Dict[str, Any]]:
         """
-        Generates a SQL query based on the mapped schema, including column selection
-        and basic WHERE clauses.
+        Generates a parameterized SQL query based on the mapped schema, including column
+        selection and WHERE clauses. Returns the SQL text and its bound parameters.
         """
         best_table = mapping.get("best_table_match")
         mapped_columns = mapping.get("mapped_columns", [])
         
         if not best_table:
-            return None
+            return None, {}
 
         # Select specific columns if mapped, otherwise select all
         select_columns = []
@@ -83,38 +112,39 @@ class QueryEngine:
         select_clause = ", ".join(select_columns)
         sql = f'SELECT {select_clause} FROM "{best_table}"'
         
-        # Basic WHERE clause generation (example for demonstration - needs much more NLP processing)
         where_clauses = []
+        params = {}
         query_lower = mapping["query"].lower()
 
-        # Example: look for simple equality phrases like 'X is Y' or 'X = Y'
-        # This is a very simplistic approach and needs significant NLP for real-world use
-        if best_table == "employees": # Example for a specific table
-            if "department" in query_lower:
-                match = re.search(r'department (is|=)?\s*(\w+)', query_lower)
-                if match:
-                    department_name = match.group(2).strip()
-                    where_clauses.append(f'"department" = \'{department_name.capitalize()}\'') # Assuming capitalized department names
-
-            if "salary" in query_lower:
-                match = re.search(r'salary (>|<|=)?\s*(\d+)', query_lower)
-                if match:
-                    operator = match.group(1) or '='
-                    salary_value = match.group(2).strip()
-                    where_clauses.append(f'"salary" {operator} {salary_value}')
+        # Equality filters on categorical values, resolved against the value index
+        # built during schema analysis (e.g. "in the New York office" -> office = 'New York')
+        for column_name, value, score in self.schema_discovery.match_filter_values(mapping["query"], best_table):
+            param = f"p{len(params)}"
+            where_clauses.append(f'"{column_name}" = :{param}')
+            params[param] = value
+
+        # Numeric comparisons such as "salary > 50000" on any numeric column of the table
+        for column in self.schema.get("tables", {}).get(best_table, {}).get("columns", []):
+            if not NUMERIC_TYPE_PATTERN.search(column["type"]):
+                continue
+            column_phrase = re.escape(column["name"].lower()).replace("_", "[ _]")
+            match = re.search(rf'\b{column_phrase}\s*(>=|<=|>|<|=)?\s*(\d+(?:\.\d+)?)\b', query_lower)
+            if match:
+                operator = match.group(1) or '='
+                param = f"p{len(params)}"
+                where_clauses.append(f'"{column["name"]}" {operator} :{param}')
+                params[param] = float(match.group(2)) if "." in match.group(2) else int(match.group(2))
 
         if where_clauses:
             sql += " WHERE " + " AND ".join(where_clauses)
 
         sql += " LIMIT 20;" # Always limit results for safety
 
-        return sql
+        return sql, params
 
     async def process_query(self, query: str) -> dict:
         """Main method to process a user's natural language query."""
-        start_time = time.time()
-
-        cached_result = self.cache.get(query)
+        cached_result = await self.cache.get(query)
         if cached_result:
             cached_result["cached"] = True
             return cached_result
@@ -122,6 +152,29 @@ class QueryEngine:
         if "error" in self.schema:
             return {"error": f"Cannot process query, schema not loaded: {self.schema['error']}"}
 
+        result = await self._run_query(query)
+        await self.cache.set(query, result)
+        return result
+
+    async def prewarm_query(self, query: str) -> Optional[bool]:
+        """
+        Runs `query` and caches its result unless it is already cached, without counting
+        towards the cache hit rate. Returns True if a new result was cached, False if one
+        was already cached, and None if the query failed.
+        """
+        if "error" in self.schema:
+            return None
+        if await self.cache.get(query, record=False) is not None:
+            return False
+        result = await self._run_query(query)
+        if "error" in (result.get("sql_result") or {}):
+            return None
+        await self.cache.set(query, result, prewarmed=True)
+        return True
+
+    async def _run_query(self, query: str) -> dict:
+        """Classifies `query` and runs the SQL and/or document search it needs."""
+        start_time = time.time()
         query_type = self._classify_query(query)
         result = {"type": query_type, "performance_metrics": {}}
         
@@ -139,8 +192,6 @@ class QueryEngine:
         
         end_time = time.time()
         result["performance_metrics"]["response_time"] = end_time - start_time
-        
-        self.cache.set(query, result)
         return result
 
     async def _execute_sql_query(self, query: str) -> dict:
@@ -150,16 +201,16 @@ class QueryEngine:
             mapping = self.schema_discovery.map_natural_language_to_schema(query, self.schema)
             
             # Generate SQL from mapping
-            sql_query = self._generate_sql(mapping)
+            sql_query, params = self._generate_sql(mapping)
             if not sql_query:
                 return {"error": "Could not determine a database table to query."}
 
-            # Execute query
+            # Execute query with bound parameters
             async with self.async_engine.connect() as conn:
-                result_proxy = await conn.execute(text(sql_query))
+                result_proxy = await conn.execute(text(sql_query), params)
                 data = [dict(row) for row in result_proxy.mappings()]
             
-            return {"generated_sql": sql_query, "data": data}
+            return {"generated_sql": sql_query, "parameters": params, "data": data}
         except Exception as e:
             logging.error(f"Error executing SQL query: {e}")
             return {"error": str(e)}
\ No newline at end of file
@@ -1,28 +1,48 @@
+import os
 import logging
+from typing import Dict, List, Optional, Tuple
 from sqlalchemy import create_engine, inspect, text
-from rapidfuzz import process, fuzz
+from sqlalchemy.types import String
+from rapidfuzz import process, fuzz, utils
 import numpy as np
 
-# Lazy loading for sentence-transformers
-_model = None
-
-def get_sentence_transformer_model():
-    global _model
-    if _model is None:
-        try:
-            from sentence_transformers import SentenceTransformer
-            _model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-        except ImportError:
-            logging.error("Sentence-transformers library not found. Please install it.")
-            return None
-    return _model
+from services.embedding_index import EmbeddingIndex
+from services.embedding_model import get_sentence_transformer_model
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Number of best semantic column matches that are exactly re-scored during mapping
+SCHEMA_RESCORE_CANDIDATES = 32
+
+# Categorical value index: text columns with at most VALUE_INDEX_MAX_DISTINCT distinct
+# values have those values indexed, up to VALUE_INDEX_MAX_VALUES values per database.
+VALUE_INDEX_MAX_DISTINCT = int(os.getenv("VALUE_INDEX_MAX_DISTINCT", 100))
+VALUE_INDEX_MAX_VALUES = int(os.getenv("VALUE_INDEX_MAX_VALUES", 10000))
+VALUE_INDEX_MAX_LENGTH = 100
+# Minimum fuzzy score for a run of query words to match an indexed value of the same
+# number of words. Values shorter than VALUE_MIN_FUZZY_LENGTH characters must match exactly.
+VALUE_MATCH_THRESHOLD = 90
+VALUE_MIN_FUZZY_LENGTH = 4
+# A value is taken as a filter only in a filter context: right after one of FILTER_WORDS
+# ("in the London office"), right before the table's name ("Engineering employees"), or
+# when its column is named in the query ("the Data department"). A plain mention such as
+# "show me salary data" or a grouping such as "by manager" does not filter.
+FILTER_WORDS = {"in", "at", "from", "for", "of", "with", "on", "is"}
+ARTICLES = {"the", "a", "an"}
+
 class SchemaDiscovery:
     """
     Analyzes a database to discover its schema and maps natural language to it.
+
+    Column embeddings are kept out of the (JSON-served) schema dict, in a packed
+    `EmbeddingIndex` whose rows line up with `column_keys` ("table.column").
+    Distinct values of low-cardinality text columns are kept in `value_index`
+    ({table: {column: {value: normalized value}}}) to resolve filter literals.
     """
+    def __init__(self):
+        self.column_index = EmbeddingIndex()
+        self.column_keys = []
+        self.value_index: Dict[str, Dict[str, Dict[str, str]]] = {}
 
     def analyze_database(self, connection_string: str) -> dict:
         """
@@ -42,6 +62,8 @@ class SchemaDiscovery:
             return {"error": f"Invalid connection string: {e}"}
 
         schema = {"tables": {}}
+        column_keys, column_embeddings = [], []
+        value_index, value_budget = {}, VALUE_INDEX_MAX_VALUES
         try:
             table_names = inspector.get_table_names()
             with engine.connect() as connection:
@@ -51,8 +73,8 @@ class SchemaDiscovery:
                         col_info = {
                             "name": column['name'],
                             "type": str(column['type']),
-                            "embedding": model.encode([column['name']])[0].tolist(),
                         }
+                        embedding = model.encode([column['name']])[0]
                         
                         # Augment embedding with sample data if possible
                         try:
@@ -62,11 +84,19 @@ class SchemaDiscovery:
                                 sample_data = [str(row[0]) for row in sample_result]
                                 sample_embedding = model.encode(sample_data)
                                 # Average the column name embedding with data embeddings
-                                col_info["embedding"] = np.mean([col_info["embedding"]] + list(sample_embedding), axis=0).tolist()
+                                embedding = np.mean([embedding] + list(sample_embedding), axis=0)
                         except Exception:
                             pass # Ignore sampling errors
+
+                        if isinstance(column['type'], String) and value_budget > 0:
+                            values = self._index_column_values(connection, table_name, column['name'], col_info, value_budget)
+                            if values:
+                                value_index.setdefault(table_name, {})[column['name']] = values
+                                value_budget -= len(values)
                         
                         columns.append(col_info)
+                        column_keys.append(f"{table_name}.{column['name']}")
+                        column_embeddings.append(embedding)
 
                     schema["tables"][table_name] = {
                         "columns": columns,
@@ -77,9 +107,165 @@ class SchemaDiscovery:
         except Exception as e:
             logging.error(f"An error occurred during schema inspection: {e}")
             return {"error": f"Schema inspection failed: {e}"}
+
+        column_index = EmbeddingIndex()
+        column_index.add(column_embeddings)
+        self.column_index.close()
+        self.column_index, self.column_keys = column_index, column_keys
+        self.value_index = value_index
+        schema["embedding_storage"] = {"precision": column_index.precision, "bytes": column_index.nbytes}
             
         return schema
 
+    def estimated_memory_bytes(self) -> int:
+        """Approximate memory held by the column embeddings and the value index."""
+        size = self.column_index.nbytes
+        for columns in self.value_index.values():
+            for values in columns.values():
+                size += sum(len(value) + len(normalized) for value, normalized in values.items())
+        return size
+
+    def _index_column_values(self, connection, table_name: str, column_name: str, col_info: dict, budget: int) -> Dict[str, str]:
+        """
+        Records the column's cardinality in `col_info` and, if the column is
+        low-cardinality and fits in the remaining budget, returns its distinct values
+        mapped to their normalized form for fuzzy matching.
+
+        The database's own statistics are consulted first (see _estimate_distinct): a
+        column they show as high-cardinality is not read at all. Otherwise a
+        `SELECT DISTINCT ... LIMIT` fetches at most VALUE_INDEX_MAX_DISTINCT + 1 values.
+        SQLite stops scanning once the limit is reached, but on server databases an
+        unindexed column is scanned in full, hence the statistics.
+        """
+        estimate = self._estimate_distinct(connection, table_name, column_name)
+        if estimate is not None and estimate > VALUE_INDEX_MAX_DISTINCT:
+            col_info["high_cardinality"] = True
+            return {}
+
+        quote = connection.dialect.identifier_preparer.quote
+        try:
+            rows = connection.execute(
+                text(f'SELECT DISTINCT {quote(column_name)} FROM {quote(table_name)} WHERE {quote(column_name)} IS NOT NULL LIMIT :limit'),
+                {"limit": VALUE_INDEX_MAX_DISTINCT + 1}
+            ).fetchall()
+        except Exception:
+            return {} # Ignore statistics errors
+
+        col_info["high_cardinality"] = len(rows) > VALUE_INDEX_MAX_DISTINCT
+        if col_info["high_cardinality"]:
+            return {}
+        col_info["distinct_values"] = len(rows)
+        if not rows or len(rows) > budget:
+            return {}
+
+        values = {}
+        for (value,) in rows:
+            if isinstance(value, str) and len(value) <= VALUE_INDEX_MAX_LENGTH:
+                normalized = utils.default_process(value)
+                if normalized:
+                    values[value] = normalized
+        col_info["categorical"] = bool(values)
+        return values
+
+    @staticmethod
+    def _estimate_distinct(connection, table_name: str, column_name: str) -> Optional[int]:
+        """
+        Estimates the column's number of distinct values from the database's statistics:
+        `pg_stats.n_distinct` on PostgreSQL, the cardinality of an index starting with
+        the column on MySQL/MariaDB. Returns None when there are none (SQLite, tables
+        never analyzed, unindexed MySQL columns).
+        """
+        dialect = connection.dialect.name
+        params = {"table": table_name, "column": column_name}
+        try:
+            if dialect == "postgresql":
+                row = connection.execute(text(
+                    "SELECT s.n_distinct, c.reltuples FROM pg_stats s "
+                    "JOIN pg_namespace n ON n.nspname = s.schemaname "
+                    "JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = s.tablename "
+                    "WHERE s.schemaname = current_schema() AND s.tablename = :table AND s.attname = :column"
+                ), params).first()
+                if row is None or not row[0]:
+                    return None
+                n_distinct, row_count = row
+                if n_distinct > 0:
+                    return int(n_distinct)
+                # A negative n_distinct is a fraction of the row count; reltuples is -1 if unknown
+                return int(-n_distinct * row_count) if row_count >= 0 else None
+            if dialect in ("mysql", "mariadb"):
+                row = connection.execute(text(
+                    "SELECT MAX(CARDINALITY) FROM information_schema.STATISTICS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table "
+                    "AND COLUMN_NAME = :column AND SEQ_IN_INDEX = 1"
+                ), params).first()
+                return int(row[0]) if row is not None and row[0] is not None else None
+        except Exception:
+            # A failed statement aborts the transaction on PostgreSQL; fall back to reading the values
+            connection.rollback()
+        return None
+
+    def match_filter_values(self, query: str, table_name: str) -> List[Tuple[str, str, float]]:
+        """
+        Finds indexed column values of `table_name` mentioned in the query, e.g.
+        "in the New York office" -> ("office", "New York", 100.0), using the in-memory
+        value index only.
+
+        Each value is compared with the runs of query words as long as the value, so
+        "database" does not match the value "Data", and must appear in a filter context
+        (see FILTER_WORDS). A value found in several columns is kept only for the best
+        column (preferring a column named in the query), and each column and each span
+        of the query yields at most one
+        `(column, value, score)` match.
+        """
+        words = utils.default_process(query).split()
+        padded_query = f" {' '.join(words)} "
+        table_noun = utils.default_process(table_name.replace('_', ' ')).rstrip("s")
+        windows: Dict[int, List[str]] = {}
+        candidates = []
+        for column_name, values in self.value_index.get(table_name, {}).items():
+            column_mentioned = f" {utils.default_process(column_name.replace('_', ' '))} " in padded_query
+            by_length: Dict[int, Dict[str, str]] = {}
+            for value, normalized in values.items():
+                by_length.setdefault(len(normalized.split()), {})[value] = normalized
+            for length, group in by_length.items():
+                if length not in windows:
+                    windows[length] = [" ".join(words[i:i + length]) for i in range(len(words) - length + 1)]
+                if not windows[length]:
+                    continue
+                scores = process.cdist(
+                    list(group.values()), windows[length], scorer=fuzz.ratio,
+                    processor=None, score_cutoff=VALUE_MATCH_THRESHOLD
+                )
+                for (value, normalized), row in zip(group.items(), scores):
+                    for start in np.flatnonzero(row):
+                        score = float(row[start])
+                        # Short values ("HR", "IT") must match a whole word exactly
+                        if len(normalized) < VALUE_MIN_FUZZY_LENGTH and score < 100:
+                            continue
+                        if not (column_mentioned or self._in_filter_context(words, start, start + length, table_noun)):
+                            continue
+                        candidates.append((score, column_mentioned, column_name, value, normalized, range(start, start + length)))
+
+        matches, used_columns, used_values, used_words = [], set(), set(), set()
+        for score, _, column_name, value, normalized, span in sorted(candidates, key=lambda c: (c[0], c[1]), reverse=True):
+            if column_name in used_columns or normalized in used_values or used_words.intersection(span):
+                continue
+            matches.append((column_name, value, score))
+            used_columns.add(column_name)
+            used_values.add(normalized)
+            used_words.update(span)
+        return matches
+
+    @staticmethod
+    def _in_filter_context(words: List[str], start: int, end: int, table_noun: str) -> bool:
+        """Whether query words [start, end) follow a filter word or precede the table's name."""
+        before = start - 1
+        while before >= 0 and words[before] in ARTICLES:
+            before -= 1
+        if before >= 0 and words[before] in FILTER_WORDS:
+            return True
+        return end < len(words) and bool(table_noun) and words[end].rstrip("s") == table_noun
+
     def map_natural_language_to_schema(self, query: str, schema: dict) -> dict:
         """
         Maps terms in a natural language query to the most likely tables and columns
@@ -97,28 +283,29 @@ class SchemaDiscovery:
         table_scores = []
         column_scores = []
 
+        # Semantic similarity for every column in one pass over the packed index
+        semantic_scores = dict(self.column_index.search(
+            query_embedding, top_k=len(self.column_index), rescore_k=SCHEMA_RESCORE_CANDIDATES
+        ))
+
         for table_name, table_info in schema["tables"].items():
-            # Aggregate column embeddings for table representation
-            table_embeddings = [col['embedding'] for col in table_info['columns']]
-            if table_embeddings:
-                avg_table_embedding = np.mean(table_embeddings, axis=0)
+            if table_info['columns']:
                 table_similarity = fuzz.ratio(query.lower(), table_name.lower()) # Keep fuzzy for table names
-                # semantic_similarity = np.dot(query_embedding, avg_table_embedding) / (np.linalg.norm(query_embedding) * np.linalg.norm(avg_table_embedding))
                 # For simplicity, we'll just use fuzzy ratio for table names for now, 
                 # as semantic similarity for aggregated table embeddings can be complex.
                 table_scores.append((table_name, table_similarity))
 
-            for col_info in table_info['columns']:
-                col_name = col_info['name']
-                col_embedding = col_info['embedding']
-                
-                semantic_similarity = np.dot(query_embedding, col_embedding) / (np.linalg.norm(query_embedding) * np.linalg.norm(col_embedding))
-                fuzzy_similarity = fuzz.ratio(query.lower(), col_name.lower())
-                
-                # Combine semantic and fuzzy similarity (e.g., weighted average)
-                # This weighting can be tuned. Semantic is more important for conceptual match.
-                combined_similarity = (semantic_similarity * 0.7 + fuzzy_similarity * 0.3)
-                column_scores.append((f"{table_name}.{col_name}", combined_similarity))
+        for row, column_key in enumerate(self.column_keys):
+            table_name, col_name = column_key.split('.', 1)
+            if table_name not in schema["tables"]:
+                continue
+            semantic_similarity = semantic_scores.get(row, 0.0)
+            fuzzy_similarity = fuzz.ratio(query.lower(), col_name.lower())
+            
+            # Combine semantic and fuzzy similarity (e.g., weighted average)
+            # This weighting can be tuned. Semantic is more important for conceptual match.
+            combined_similarity = (semantic_similarity * 0.7 + fuzzy_similarity * 0.3)
+            column_scores.append((column_key, combined_similarity))
 
         # Sort by combined similarity in descending order
         table_scores.sort(key=lambda x: x[1], reverse=True)
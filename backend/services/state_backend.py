@@ -0,0 +1,520 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Topics published through the change notification mechanism.
+CHUNKS_TOPIC = "chunks"
+DATABASES_TOPIC = "databases"
+
+# Distinct (database, query) pairs whose run counts are kept; the least used are dropped first.
+QUERY_LOG_MAX_ENTRIES = int(os.getenv("QUERY_LOG_MAX_ENTRIES", 10000))
+
+
+class StateBackend(ABC):
+    """
+    Storage for the runtime state that must be shared between API workers: ingestion
+    jobs, query history and run counts, the query result cache, the document chunk
+    store and the registered databases.
+
+    Writers bump a per-topic version; other workers are told about the change through
+    callbacks registered with `subscribe`.
+    """
+    def __init__(self):
+        self._listeners: Dict[str, List[Callable[[], Awaitable[None]]]] = defaultdict(list)
+
+    def subscribe(self, topic: str, callback: Callable[[], Awaitable[None]]):
+        """Registers an async callback invoked whenever `topic` changes."""
+        self._listeners[topic].append(callback)
+
+    async def _notify(self, topic: str):
+        for callback in self._listeners.get(topic, []):
+            try:
+                await callback()
+            except Exception as e:
+                logging.error(f"State change listener for '{topic}' failed: {e}")
+
+    async def start(self):
+        """Starts any background machinery (e.g. change watchers)."""
+
+    async def close(self):
+        """Releases resources held by the backend."""
+
+    # Ingestion jobs
+    @abstractmethod
+    async def set_job(self, job_id: str, job: Dict[str, Any]):
+        """Stores (or replaces) the record of job `job_id`."""
+
+    @abstractmethod
+    async def update_job(self, job_id: str, **fields):
+        """Updates the given fields of job `job_id`, creating the record if needed."""
+
+    @abstractmethod
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Returns a copy of the record of job `job_id`, or None if it is unknown."""
+
+    @abstractmethod
+    async def get_jobs(self, exclude_statuses: Tuple[str, ...] = ()) -> Dict[str, Dict[str, Any]]:
+        """Returns the records of all jobs whose status is not in `exclude_statuses`, by job id."""
+
+    @abstractmethod
+    async def prune_jobs(self, keep: int, statuses: Tuple[str, ...]) -> List[Dict[str, Any]]:
+        """
+        Deletes all but the `keep` most recently updated jobs whose status is in
+        `statuses`, and returns the deleted jobs.
+        """
+
+    # Query history
+    @abstractmethod
+    async def add_query(self, query: str, database: str = "default"):
+        """Appends `query` to the history and increments its run count for `database`."""
+
+    @abstractmethod
+    async def get_query_history(self) -> List[str]:
+        """Returns the most recent queries, oldest first."""
+
+    @abstractmethod
+    async def get_top_queries(self, limit: int, database: str = "default") -> List[Tuple[str, int]]:
+        """Returns up to `limit` `(query, count)` pairs for `database`, most frequent first."""
+
+    # Query result cache
+    @abstractmethod
+    async def cache_get(self, key: str) -> Optional[Tuple[Any, float, bool]]:
+        """Returns `(value, timestamp, prewarmed)` for `key`, or None if it is not cached."""
+
+    @abstractmethod
+    async def cache_set(self, key: str, value: Any, max_size: int, prewarmed: bool = False):
+        """
+        Stores `value` under `key`, evicting the oldest entries beyond `max_size`.
+        `prewarmed` marks entries stored by the cache prewarmer rather than a user query.
+        """
+
+    @abstractmethod
+    async def cache_delete(self, key: str):
+        """Removes `key` from the cache, if present."""
+
+    @abstractmethod
+    async def cache_clear(self, prefix: str = ""):
+        """Removes every cache entry whose key starts with `prefix` (all entries by default)."""
+
+    # Document chunk store
+    @abstractmethod
+    async def add_chunks(self, chunks: List[Dict[str, Any]], job_id: Optional[str] = None, **job_fields):
+        """
+        Appends document chunks (with their "embedding") to the shared store. If `job_id`
+        is given, `job_fields` are updated on that job atomically with the insert.
+        """
+
+    @abstractmethod
+    async def get_chunks(self, after_id: int = 0) -> List[Tuple[int, Dict[str, Any]]]:
+        """Returns `(id, chunk)` pairs with ids greater than `after_id`, in insertion order."""
+
+    # Registered databases (name -> connection string)
+    @abstractmethod
+    async def set_database(self, name: str, connection_string: str):
+        """Registers (or re-points) database `name`."""
+
+    @abstractmethod
+    async def get_databases(self) -> Dict[str, str]:
+        """Returns the registered databases as a name -> connection string mapping."""
+
+    @abstractmethod
+    async def delete_database(self, name: str):
+        """Unregisters database `name`."""
+
+
+class InMemoryStateBackend(StateBackend):
+    """Keeps all state in the current process. Only suitable for a single worker."""
+    def __init__(self, history_size: int = 100, query_log_size: int = QUERY_LOG_MAX_ENTRIES):
+        super().__init__()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._job_updated: Dict[str, float] = {}
+        self._history = deque(maxlen=history_size)
+        self.query_log_size = query_log_size
+        # (database, query) -> (count, last_used)
+        self._query_counts: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        self._cache: Dict[str, Tuple[Any, float, bool]] = {}
+        self._chunks: List[Dict[str, Any]] = []
+        self._databases: Dict[str, str] = {}
+
+    async def set_job(self, job_id: str, job: Dict[str, Any]):
+        self._jobs[job_id] = dict(job)
+        self._job_updated[job_id] = time.time()
+
+    async def update_job(self, job_id: str, **fields):
+        self._jobs.setdefault(job_id, {}).update(fields)
+        self._job_updated[job_id] = time.time()
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    async def get_jobs(self, exclude_statuses: Tuple[str, ...] = ()) -> Dict[str, Dict[str, Any]]:
+        return {job_id: dict(job) for job_id, job in self._jobs.items() if job.get("status") not in exclude_statuses}
+
+    async def prune_jobs(self, keep: int, statuses: Tuple[str, ...]) -> List[Dict[str, Any]]:
+        finished = [job_id for job_id, job in self._jobs.items() if job.get("status") in statuses]
+        finished.sort(key=lambda job_id: self._job_updated[job_id], reverse=True)
+        removed = []
+        for job_id in finished[keep:]:
+            removed.append(self._jobs.pop(job_id))
+            del self._job_updated[job_id]
+        return removed
+
+    async def add_query(self, query: str, database: str = "default"):
+        self._history.append(query)
+        count, _ = self._query_counts.get((database, query), (0, 0.0))
+        self._query_counts[(database, query)] = (count + 1, time.time())
+        if len(self._query_counts) > self.query_log_size:
+            least_used = min(self._query_counts, key=lambda key: self._query_counts[key])
+            del self._query_counts[least_used]
+
+    async def get_query_history(self) -> List[str]:
+        return list(self._history)
+
+    async def get_top_queries(self, limit: int, database: str = "default") -> List[Tuple[str, int]]:
+        counts = [(query, count, last_used) for (db, query), (count, last_used) in self._query_counts.items() if db == database]
+        counts.sort(key=lambda item: (item[1], item[2]), reverse=True)
+        return [(query, count) for query, count, _ in counts[:limit]]
+
+    async def cache_get(self, key: str) -> Optional[Tuple[Any, float, bool]]:
+        return self._cache.get(key)
+
+    async def cache_set(self, key: str, value: Any, max_size: int, prewarmed: bool = False):
+        if key not in self._cache and len(self._cache) >= max_size:
+            # Simple eviction policy: remove the oldest entry
+            oldest_key = min(self._cache, key=lambda k: self._cache[k][1])
+            del self._cache[oldest_key]
+        self._cache[key] = (value, time.time(), prewarmed)
+
+    async def cache_delete(self, key: str):
+        self._cache.pop(key, None)
+
+    async def cache_clear(self, prefix: str = ""):
+        if prefix:
+            self._cache = {key: entry for key, entry in self._cache.items() if not key.startswith(prefix)}
+        else:
+            self._cache = {}
+
+    async def add_chunks(self, chunks: List[Dict[str, Any]], job_id: Optional[str] = None, **job_fields):
+        self._chunks.extend(chunks)
+        if job_id is not None:
+            await self.update_job(job_id, **job_fields)
+        await self._notify(CHUNKS_TOPIC)
+
+    async def get_chunks(self, after_id: int = 0) -> List[Tuple[int, Dict[str, Any]]]:
+        return [(i + 1, chunk) for i, chunk in enumerate(self._chunks[after_id:], start=after_id)]
+
+    async def set_database(self, name: str, connection_string: str):
+        self._databases[name] = connection_string
+        await self._notify(DATABASES_TOPIC)
+
+    async def get_databases(self) -> Dict[str, str]:
+        return dict(self._databases)
+
+    async def delete_database(self, name: str):
+        self._databases.pop(name, None)
+        await self._notify(DATABASES_TOPIC)
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    Stores state in a local SQLite database (WAL mode) so that several worker processes
+    on one host share ingestion jobs, history, cache and documents. A watcher task polls
+    the `changes` table and notifies subscribers of writes made by other workers.
+    """
+    def __init__(self, path: str, history_size: int = 100, poll_interval: float = 0.5, query_log_size: int = QUERY_LOG_MAX_ENTRIES):
+        super().__init__()
+        self.path = path
+        self.history_size = history_size
+        self.query_log_size = query_log_size
+        self.poll_interval = poll_interval
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS query_history (id INTEGER PRIMARY KEY AUTOINCREMENT, query TEXT NOT NULL, created_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS query_counts (
+                database TEXT NOT NULL,
+                query TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (database, query)
+            );
+            CREATE INDEX IF NOT EXISTS query_counts_rank ON query_counts (database, count, last_used);
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                timestamp REAL NOT NULL,
+                prewarmed INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS cache_timestamp ON cache (timestamp);
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_path TEXT NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                embedding BLOB
+            );
+            CREATE TABLE IF NOT EXISTS changes (topic TEXT PRIMARY KEY, version INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS databases (name TEXT PRIMARY KEY, connection_string TEXT NOT NULL);
+        """)
+        # State files created before cache entries were marked as prewarmed
+        cache_columns = {row[1] for row in self._conn.execute("PRAGMA table_info(cache)")}
+        if "prewarmed" not in cache_columns:
+            self._conn.execute("ALTER TABLE cache ADD COLUMN prewarmed INTEGER NOT NULL DEFAULT 0")
+        self._seen_versions = self._read_versions()
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def _run(self, fn: Callable, *args):
+        """Runs a blocking database operation in a thread, serialised on the connection."""
+        def locked():
+            with self._lock:
+                return fn(*args)
+        return await asyncio.to_thread(locked)
+
+    def _transaction(self, fn: Callable, *args):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(*args)
+            self._conn.execute("COMMIT")
+            return result
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _bump(self, topic: str):
+        self._conn.execute(
+            "INSERT INTO changes (topic, version) VALUES (?, 1) "
+            "ON CONFLICT(topic) DO UPDATE SET version = version + 1",
+            (topic,)
+        )
+
+    def _read_versions(self) -> Dict[str, int]:
+        return dict(self._conn.execute("SELECT topic, version FROM changes").fetchall())
+
+    async def start(self):
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch_changes())
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        with self._lock:
+            self._conn.close()
+
+    async def _watch_changes(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                versions = await self._run(self._read_versions)
+            except Exception as e:
+                logging.error(f"Failed to poll state changes: {e}")
+                continue
+            changed = [topic for topic, version in versions.items() if self._seen_versions.get(topic) != version]
+            self._seen_versions = versions
+            for topic in changed:
+                await self._notify(topic)
+
+    # Ingestion jobs
+    async def set_job(self, job_id: str, job: Dict[str, Any]):
+        await self._run(
+            self._conn.execute,
+            "INSERT OR REPLACE INTO jobs (job_id, data, updated_at) VALUES (?, ?, ?)",
+            (job_id, json.dumps(job), time.time())
+        )
+
+    async def update_job(self, job_id: str, **fields):
+        await self._run(self._transaction, self._update_job_row, job_id, fields)
+
+    def _update_job_row(self, job_id: str, fields: Dict[str, Any]):
+        row = self._conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        job = json.loads(row[0]) if row else {}
+        job.update(fields)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, data, updated_at) VALUES (?, ?, ?)",
+            (job_id, json.dumps(job), time.time())
+        )
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        def fetch():
+            return self._conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        row = await self._run(fetch)
+        return json.loads(row[0]) if row else None
+
+    async def get_jobs(self, exclude_statuses: Tuple[str, ...] = ()) -> Dict[str, Dict[str, Any]]:
+        placeholders = ", ".join("?" for _ in exclude_statuses)
+
+        def fetch():
+            return self._conn.execute(
+                f"SELECT job_id, data FROM jobs WHERE coalesce(json_extract(data, '$.status'), '') NOT IN ({placeholders})",
+                exclude_statuses
+            ).fetchall()
+        return {job_id: json.loads(data) for job_id, data in await self._run(fetch)}
+
+    async def prune_jobs(self, keep: int, statuses: Tuple[str, ...]) -> List[Dict[str, Any]]:
+        placeholders = ", ".join("?" for _ in statuses)
+
+        def prune():
+            rows = self._conn.execute(
+                f"SELECT job_id, data FROM jobs WHERE json_extract(data, '$.status') IN ({placeholders}) "
+                "ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+                (*statuses, keep)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id, _ in rows])
+            return rows
+        return [json.loads(data) for _, data in await self._run(self._transaction, prune)]
+
+    # Query history
+    async def add_query(self, query: str, database: str = "default"):
+        def add():
+            now = time.time()
+            cursor = self._conn.execute(
+                "INSERT INTO query_history (query, created_at) VALUES (?, ?)", (query, now)
+            )
+            self._conn.execute("DELETE FROM query_history WHERE id <= ?", (cursor.lastrowid - self.history_size,))
+            self._conn.execute(
+                "INSERT INTO query_counts (database, query, count, last_used) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT(database, query) DO UPDATE SET count = count + 1, last_used = excluded.last_used",
+                (database, query, now)
+            )
+            excess = self._conn.execute("SELECT COUNT(*) FROM query_counts").fetchone()[0] - self.query_log_size
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM query_counts WHERE rowid IN "
+                    "(SELECT rowid FROM query_counts ORDER BY count, last_used LIMIT ?)",
+                    (excess,)
+                )
+        await self._run(self._transaction, add)
+
+    async def get_query_history(self) -> List[str]:
+        def fetch():
+            return self._conn.execute(
+                "SELECT query FROM (SELECT id, query FROM query_history ORDER BY id DESC LIMIT ?) ORDER BY id",
+                (self.history_size,)
+            ).fetchall()
+        return [row[0] for row in await self._run(fetch)]
+
+    async def get_top_queries(self, limit: int, database: str = "default") -> List[Tuple[str, int]]:
+        def fetch():
+            return self._conn.execute(
+                "SELECT query, count FROM query_counts WHERE database = ? "
+                "ORDER BY count DESC, last_used DESC LIMIT ?",
+                (database, limit)
+            ).fetchall()
+        return [(query, count) for query, count in await self._run(fetch)]
+
+    # Query result cache
+    async def cache_get(self, key: str) -> Optional[Tuple[Any, float, bool]]:
+        def fetch():
+            return self._conn.execute("SELECT value, timestamp, prewarmed FROM cache WHERE key = ?", (key,)).fetchone()
+        row = await self._run(fetch)
+        return (pickle.loads(row[0]), row[1], bool(row[2])) if row else None
+
+    async def cache_set(self, key: str, value: Any, max_size: int, prewarmed: bool = False):
+        payload = pickle.dumps(value)
+
+        def store():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, timestamp, prewarmed) VALUES (?, ?, ?, ?)",
+                (key, payload, time.time(), int(prewarmed))
+            )
+            # Evict the oldest entries beyond max_size
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY timestamp DESC LIMIT -1 OFFSET ?)",
+                (max_size,)
+            )
+        await self._run(self._transaction, store)
+
+    async def cache_delete(self, key: str):
+        await self._run(self._conn.execute, "DELETE FROM cache WHERE key = ?", (key,))
+
+    async def cache_clear(self, prefix: str = ""):
+        def clear():
+            self._conn.execute("DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+        await self._run(self._transaction, clear)
+
+    # Document chunk store
+    async def add_chunks(self, chunks: List[Dict[str, Any]], job_id: Optional[str] = None, **job_fields):
+        rows = [(
+            chunk["file_path"],
+            chunk["chunk_id"],
+            chunk["content"],
+            np.asarray(chunk["embedding"], dtype=np.float32).tobytes() if chunk.get("embedding") is not None else None,
+        ) for chunk in chunks]
+
+        def insert():
+            self._conn.executemany(
+                "INSERT INTO chunks (file_path, chunk_id, content, embedding) VALUES (?, ?, ?, ?)", rows
+            )
+            if job_id is not None:
+                self._update_job_row(job_id, job_fields)
+            self._bump(CHUNKS_TOPIC)
+        await self._run(self._transaction, insert)
+
+    async def get_chunks(self, after_id: int = 0) -> List[Tuple[int, Dict[str, Any]]]:
+        def fetch():
+            return self._conn.execute(
+                "SELECT id, file_path, chunk_id, content, embedding FROM chunks WHERE id > ? ORDER BY id",
+                (after_id,)
+            ).fetchall()
+        return [(row_id, {
+            "file_path": file_path,
+            "chunk_id": chunk_id,
+            "content": content,
+            "embedding": np.frombuffer(embedding, dtype=np.float32) if embedding is not None else None,
+        }) for row_id, file_path, chunk_id, content, embedding in await self._run(fetch)]
+
+    # Registered databases
+    async def set_database(self, name: str, connection_string: str):
+        def store():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO databases (name, connection_string) VALUES (?, ?)",
+                (name, connection_string)
+            )
+            self._bump(DATABASES_TOPIC)
+        await self._run(self._transaction, store)
+
+    async def get_databases(self) -> Dict[str, str]:
+        def fetch():
+            return self._conn.execute("SELECT name, connection_string FROM databases").fetchall()
+        return dict(await self._run(fetch))
+
+    async def delete_database(self, name: str):
+        def delete():
+            self._conn.execute("DELETE FROM databases WHERE name = ?", (name,))
+            self._bump(DATABASES_TOPIC)
+        await self._run(self._transaction, delete)
+
+
+def create_state_backend() -> StateBackend:
+    """
+    Builds the state backend selected by the STATE_BACKEND environment variable:
+    "sqlite" (default, shared between workers) or "memory" (single process only).
+    """
+    backend = os.getenv("STATE_BACKEND", "sqlite").lower()
+    if backend == "memory":
+        return InMemoryStateBackend()
+    if backend == "sqlite":
+        path = os.getenv("STATE_DB_PATH", "./state/engine_state.db")
+        poll_interval = float(os.getenv("STATE_POLL_INTERVAL", 0.5))
+        logging.info(f"Using SQLite state backend at {path}")
+        return SQLiteStateBackend(path, poll_interval=poll_interval)
+    raise ValueError(f"Unknown STATE_BACKEND '{backend}'. Expected 'sqlite' or 'memory'.")
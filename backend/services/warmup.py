@@ -0,0 +1,56 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class WarmupTracker:
+    """
+    Tracks the background warm-up of the application (model loading, schema analysis)
+    and records how long each startup phase took.
+    """
+    def __init__(self):
+        self.ready = asyncio.Event()
+        self.status = "starting"
+        self.error: Optional[str] = None
+        self.phases: Dict[str, float] = {}
+        self._started_at = time.perf_counter()
+
+    async def run_phase(self, name: str, awaitable: Awaitable) -> Any:
+        """Awaits one startup phase and logs its duration."""
+        phase_start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            elapsed = time.perf_counter() - phase_start
+            self.phases[name] = round(elapsed, 3)
+            logging.info(f"Startup phase '{name}' finished in {elapsed:.2f}s")
+
+    def mark_ready(self):
+        self.status = "ready"
+        self.error = None
+        self.phases["total"] = round(time.perf_counter() - self._started_at, 3)
+        logging.info(f"Warm-up complete in {self.phases['total']:.2f}s")
+        self.ready.set()
+
+    def mark_degraded(self, error: Exception):
+        """
+        Warm-up finished, but the default database could not be warmed. The process
+        keeps serving (other databases can still be connected) but is not ready.
+        """
+        self.status = "degraded"
+        self.error = str(error)
+        self.phases["total"] = round(time.perf_counter() - self._started_at, 3)
+        logging.error(f"Warm-up finished without the default database: {error}")
+        self.ready.set()
+
+    def mark_failed(self, error: Exception):
+        self.status = "failed"
+        self.error = str(error)
+        logging.error(f"Warm-up failed: {error}")
+        # Release waiting requests; they will see the engine's error state
+        self.ready.set()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"status": self.status, "error": self.error, "phases": dict(self.phases)}